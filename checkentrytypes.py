@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+""" Check that marking entrytypes only for the months loaded (what loaddb.py does) gives the
+    same 'M', 'D', and 'L' flags as checking all history (what loaddb.py --remark does).
+
+    Random histories are loaded, a few dates at a time, into two scratch tables in the database:
+    one is marked incrementally after each load and the other is marked over all history.
+    The histories include reports for the previous month which arrive after the month has ended,
+    loads which start a new month, loads with nothing new, and dates filled in out of order.
+    The return code is 0 if the flags always match, 1 otherwise. """
+
+import sys, random
+from datetime import date, timedelta
+import tmglobals
+import loaddb
+myglobals = tmglobals.tmglobals()
+
+tables = ('entrytypecheck_incremental', 'entrytypecheck_full')
+
+
+def maketables(curs):
+    for t in tables:
+        curs.execute("DROP TABLE IF EXISTS %s" % t)
+        curs.execute("""CREATE TABLE %s (id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, clubnumber INT NOT NULL,
+                        asof DATE NOT NULL, monthstart DATE NOT NULL, entrytype CHAR(1) NOT NULL DEFAULT 'D',
+                        INDEX (clubnumber, monthstart), INDEX (asof))""" % t)
+
+
+def droptables(curs):
+    for t in tables:
+        curs.execute("DROP TABLE IF EXISTS %s" % t)
+
+
+def makehistory(rng, days):
+    """ Return a list of (asof, monthstart) for 'days' consecutive report dates.
+        Early in a month, Toastmasters may still be reporting on the month before. """
+    history = []
+    asof = date(2019, 6, 20) + timedelta(days=rng.randrange(60))
+    monthstart = asof.replace(day=1)
+    for i in range(days):
+        asof += timedelta(days=1)
+        if asof.day > rng.randrange(1, 8):
+            monthstart = asof.replace(day=1)
+        history.append((asof, monthstart))
+    return history
+
+
+def makeloads(rng, history):
+    """ Split the history into loads of a few dates each, holding some dates back to be
+        filled in later; some loads are empty """
+    loads = []
+    heldback = []
+    pending = list(history)
+    while pending:
+        n = min(rng.choice((0, 1, 1, 1, 2, 3)), len(pending))
+        load, pending = pending[:n], pending[n:]
+        if load and len(load) > 1 and rng.random() < 0.1:
+            heldback.append(load.pop(0))
+        if heldback and rng.random() < 0.1:
+            load.append(heldback.pop(rng.randrange(len(heldback))))
+        loads.append(load)
+    loads.append(heldback)
+    return loads
+
+
+def load(conn, name, dates, clubs):
+    """ Load the dates into the named table the way doHistorical does, then mark entrytypes
+        for the months loaded (or, for the second table, over all history) """
+    curs = conn.cursor()
+    curs.execute("SELECT MAX(asof), MAX(monthstart) FROM %s" % name)
+    (since, prevmonth) = curs.fetchone()
+    for (asof, monthstart) in dates:
+        curs.executemany("INSERT INTO " + name + " (clubnumber, asof, monthstart) VALUES (%s, %s, %s)",
+                         [(c, asof, monthstart) for c in clubs[asof]])
+    months = set('%s' % monthstart for (asof, monthstart) in dates)
+    if name == tables[0]:
+        loaddb.markentrytypes(conn, name, months, since, prevmonth)
+    else:
+        loaddb.markentrytypes(conn, name)
+
+
+def flags(curs, name):
+    curs.execute("SELECT clubnumber, asof, monthstart, entrytype FROM %s" % name)
+    return set(curs.fetchall())
+
+
+def checkhistory(conn, rng, days, nclubs):
+    """ Load one random history into both tables; return the number of loads after which they differ """
+    curs = conn.cursor()
+    maketables(curs)
+    history = makehistory(rng, days)
+    # Clubs come and go
+    clubs = {asof: [c for c in range(1, nclubs + 1) if rng.random() < 0.9] for (asof, monthstart) in history}
+    bad = 0
+    for (n, dates) in enumerate(makeloads(rng, history)):
+        for name in tables:
+            load(conn, name, dates, clubs)
+        (incremental, full) = (flags(curs, name) for name in tables)
+        if incremental != full:
+            bad += 1
+            print('After load %d (%s):' % (n + 1, ', '.join('%s' % asof for (asof, monthstart) in dates)))
+            for row in sorted(full - incremental):
+                print('   expected:', row)
+            for row in sorted(incremental - full):
+                print('   found:   ', row)
+    return bad
+
+
+### Insert classes and functions here.  The main program begins in the "if" statement below.
+
+if __name__ == "__main__":
+
+    import tmparms
+
+    # Establish parameters
+    parms = tmparms.tmparms(description=__doc__)
+    parms.add_argument('--histories', type=int, default=20, help='Number of random histories to check')
+    parms.add_argument('--days', type=int, default=120, help='Number of report dates in each history')
+    parms.add_argument('--clubs', type=int, default=10, help='Number of clubs in each history')
+    parms.add_argument('--seed', type=int, default=None, help='Random seed (to repeat a failure)')
+
+    # Do global setup
+    myglobals.setup(parms)
+    conn = myglobals.conn
+    curs = myglobals.curs
+
+    seed = parms.seed if parms.seed is not None else random.randrange(1000000)
+    rng = random.Random(seed)
+    failures = 0
+    try:
+        for h in range(parms.histories):
+            if checkhistory(conn, rng, parms.days, parms.clubs):
+                failures += 1
+    finally:
+        droptables(curs)
+        conn.commit()
+
+    print('%d of %d histories differ (seed %d)' % (failures, parms.histories, seed))
+    sys.exit(1 if failures else 0)
@@ -37,8 +37,6 @@ if __name__ == "__main__":
 
     # Do global setup
     myglobals.setup(parms)
-    curs = myglobals.curs
-    conn = myglobals.conn
     
     try:
         cd = parms.cachedir
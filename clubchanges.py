@@ -11,7 +11,7 @@
     Exit 0 if no changes; 1 if there are changes.
     
 """
-from simpleclub import Club
+from simpleclub import Club, clubindex
 import os, sys
 from tmutil import cleandate, removeSuspendedClubs, stringify
 import datetime, argparse
@@ -75,15 +75,17 @@ if __name__ == "__main__":
     
   
     namestocompare = ['place', 'address', 'city', 'state', 'zip', 'country', 'meetingday', 'meetingtime', 'area', 'division', 'district']
+    # Read the clubs for the whole period once
+    clubs = clubindex(curs, fromdate, todate)
     # Get information for clubs as of the "from" date:
-    oldclubs = Club.getClubsOn(curs, date=fromdate, goodnames=namestocompare)
+    oldclubs = clubs.getClubsOn(fromdate, goodnames=namestocompare)
     oldclubs = removeSuspendedClubs(oldclubs, curs, date=fromdate)
     newclubs = {}   # Where clubs created during the period go
     changedclubs = {}  # Where clubs changed during the period go
 
     
     # And compare to the the list of clubs at the end of the period
-    allclubs = Club.getClubsOn(curs, date=todate)
+    allclubs = clubs.getClubsOn(todate)
     allclubs = removeSuspendedClubs(allclubs, curs, date=todate)
     
     for club in list(allclubs.values()):
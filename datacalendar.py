@@ -0,0 +1,90 @@
+""" The data availability calendar:  which dates and months we have performance data for.
+
+    loaddb.py writes the calendar (from the "loaded" table) whenever it finishes loading clubperf
+    (including loads done for getperformancefiles.py --load), and resetdbto.py rewrites it, so
+    programs which only need to know whether data exists (like require.py) can read a small file
+    without going to the database at all.  Only if the file is missing or unreadable is it rebuilt
+    from the database.  If asked to check, getcalendar also compares the file with the "loaded"
+    table's latest date and number of dates for clubperf (one quick indexed query) and rebuilds
+    it if they differ.
+"""
+
+import json, os
+
+# Default for the --calendar parameter of programs which use the calendar (tmparms resolves ${workdir})
+defaultfile = '${workdir}/datacalendar.json'
+
+
+def calendarfile(parms):
+    """ The calendar file for programs without a --calendar parameter """
+    return getattr(parms, 'calendar', None) or os.path.join(parms.workdir, 'datacalendar.json')
+
+
+class datacalendar:
+    def __init__(self, tmyear=None, dates=(), months=()):
+        self.tmyear = tmyear                # The latest TM year in the database
+        self.dates = set(dates)             # 'YYYY-MM-DD' for each date with club performance data
+        self.months = set(months)           # 'YYYY-MM-01' for each month with club performance data
+
+    @classmethod
+    def fromdb(cls, curs):
+        curs.execute("SELECT MAX(tmyear) FROM lastfor")
+        tmyear = curs.fetchone()[0]
+        curs.execute("SELECT loadedfor, monthstart FROM loaded WHERE tablename = 'clubperf'")
+        rows = curs.fetchall()
+        return cls(tmyear, ('%s' % r[0] for r in rows), ('%s' % r[1] for r in rows if r[1]))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as infile:
+            info = json.load(infile)
+        return cls(info['tmyear'], info['dates'], info['months'])
+
+    def save(self, filename):
+        with open(filename + '.new', 'w') as outfile:
+            json.dump({'tmyear': self.tmyear, 'dates': sorted(self.dates), 'months': sorted(self.months)}, outfile)
+        os.replace(filename + '.new', filename)
+
+    def stamp(self):
+        """ (latest date, number of dates), to compare with stampfromdb """
+        return (max(self.dates) if self.dates else None, len(self.dates))
+
+    @staticmethod
+    def stampfromdb(curs):
+        curs.execute("SELECT MAX(loadedfor), COUNT(*) FROM loaded WHERE tablename = 'clubperf'")
+        (latest, count) = curs.fetchone()
+        return ('%s' % latest if latest else None, count)
+
+    def hasdate(self, when):
+        """ True if we have data as of the given date """
+        return '%s' % when in self.dates
+
+    def started(self, monthstart):
+        """ True if we have any data for the month beginning on 'monthstart' """
+        return '%s' % monthstart in self.months
+
+    def final(self, monthstart):
+        """ True if we have month-final data for the month:  every month but the latest is final """
+        return self.started(monthstart) and '%s' % monthstart != max(self.months)
+
+
+def getcalendar(filename, myglobals, check=False):
+    """ Return the calendar from the file (if 'check', only if it matches the database);
+        otherwise, build it from the database and save it for next time """
+    try:
+        cal = datacalendar.load(filename)
+        if not check or cal.stamp() == datacalendar.stampfromdb(myglobals.curs):
+            return cal
+    except (OSError, ValueError, KeyError):
+        pass
+    return writecalendar(myglobals.curs, filename)
+
+
+def writecalendar(curs, filename):
+    """ Build the calendar from the database, save it (if we can), and return it """
+    cal = datacalendar.fromdb(curs)
+    try:
+        cal.save(filename)
+    except OSError:
+        pass
+    return cal
@@ -1,6 +1,8 @@
 """ Handle database connections for the TMSTATS suite """
 
+import atexit, os, re, sys, threading, time, traceback
 import MySQLdb as mysql
+import MySQLdb.cursors
 
 
     
@@ -10,10 +12,196 @@ class Singleton(object):
             type._the_instance = object.__new__(type)
         return type._the_instance
     
+def streamingcursor(conn):
+    """ Return a streaming (server-side) cursor for a dbconn or a MySQLdb connection.
+        Rows come from the server as they're used instead of all at once, so memory stays flat
+        for big results; read all of them before using the connection for anything else.
+        If query instrumentation is on, so is the cursor, whichever connection it's on. """
+    db = conn if isinstance(conn, dbconn) else dbconn.__dict__.get('_the_instance')
+    if isinstance(conn, dbconn):
+        conn = conn.conn
+    curs = conn.cursor(MySQLdb.cursors.SSCursor)
+    stats = getattr(db, 'querystats', None)
+    if stats:
+        return instrumentedcursor(curs, stats)
+    return curs
+    
+class querystats():
+    """ Collects per-statement timings from instrumented cursors and writes a summary at exit.
+        Statements are grouped after replacing literals with '?', so the same query with different
+        values counts as one statement. """
+    literals = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|\b\d+(?:\.\d+)?\b")
+    
+    def __init__(self, logfile, explainms=None, top=20, repeats=100):
+        self.logfile = os.path.abspath(logfile)     # Programs may chdir before we write it
+        self.explainms = explainms
+        self.top = top
+        self.repeats = repeats      # Calls from one place before a statement is reported as N+1
+        self.stats = {}
+        self.explains = {}
+        self.lock = threading.Lock()
+        self.start = time.time()
+        atexit.register(self.report)
+        
+    def normalize(self, stmt):
+        if isinstance(stmt, bytes):
+            stmt = stmt.decode('utf8', 'replace')
+        return ' '.join(self.literals.sub('?', stmt).split())
+        
+    def callsite(self):
+        """ Where in the calling program the statement came from """
+        for frame in reversed(traceback.extract_stack()[:-3]):
+            if os.path.basename(frame.filename) != 'dbconn.py':
+                return '%s:%d (%s)' % (os.path.basename(frame.filename), frame.lineno, frame.name)
+        return '?'
+        
+    def record(self, curs, stmt, elapsed, rows):
+        key = self.normalize(stmt)
+        site = self.callsite()
+        with self.lock:
+            entry = self.stats.setdefault(key, {'count': 0, 'time': 0.0, 'max': 0.0, 'rows': 0, 'sites': {}})
+            entry['count'] += 1
+            entry['time'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            entry['rows'] += max(rows, 0)
+            entry['sites'][site] = entry['sites'].get(site, 0) + 1
+            explain = (self.explainms is not None and elapsed * 1000 >= self.explainms and key not in self.explains)
+            if explain:
+                self.explains[key] = None
+        if explain:
+            self.explains[key] = self.explain(curs)
+        return key
+        
+    def addfetch(self, key, elapsed, rows):
+        """ Charge the time spent reading a streaming cursor's rows to the statement that produced them """
+        with self.lock:
+            entry = self.stats.get(key)
+            if entry:
+                entry['time'] += elapsed
+                entry['rows'] += rows
+            
+    def explain(self, curs):
+        """ Run EXPLAIN on the statement curs just executed (not possible for streaming cursors,
+            whose results are still pending on the connection) """
+        executed = getattr(curs, '_executed', None)
+        if not executed or isinstance(curs, MySQLdb.cursors.SSCursor):
+            return None
+        if isinstance(executed, bytes):
+            executed = executed.decode('utf8', 'replace')
+        if executed.split(None, 1)[0].upper() not in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE'):
+            return None
+        try:
+            ecurs = curs.connection.cursor()
+            ecurs.execute('EXPLAIN ' + executed)
+            cols = [d[0] for d in ecurs.description]
+            res = [cols] + [['%s' % v for v in row] for row in ecurs.fetchall()]
+            ecurs.close()
+            return res
+        except mysql.Error as e:
+            return [['EXPLAIN failed: %s' % e]]
+            
+    def reset(self):
+        """ Forget what we've recorded and start timing again """
+        with self.lock:
+            self.stats = {}
+            self.explains = {}
+            self.start = time.time()
+            
+    def report(self, label=None):
+        """ Append the summary to the log; 'label' (default: the program name) identifies the run """
+        if not self.stats:
+            return
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda item: item[1]['time'], reverse=True)
+        total = sum(e['time'] for (k, e) in stats)
+        calls = sum(e['count'] for (k, e) in stats)
+        out = []
+        out.append('=== %s at %s: %d statements, %d distinct, %.3fs in the database, %.3fs elapsed' %
+                   (label or os.path.basename(sys.argv[0]) or 'python', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start)),
+                    calls, len(stats), total, time.time() - self.start))
+        out.append('Top statements by total time:')
+        out.append('%9s %7s %9s %9s %9s  %s' % ('total', 'count', 'avg ms', 'max ms', 'rows', 'statement'))
+        for (key, e) in stats[:self.top]:
+            out.append('%9.3f %7d %9.2f %9.2f %9d  %s' % (e['time'], e['count'], 1000 * e['time'] / e['count'], 1000 * e['max'], e['rows'], key[:200]))
+            for (site, n) in sorted(e['sites'].items(), key=lambda item: item[1], reverse=True)[:3]:
+                out.append('%47s %7d from %s' % ('', n, site))
+            plan = self.explains.get(key)
+            if plan:
+                for row in plan:
+                    out.append('%47s %s' % ('', ' | '.join(row)))
+        repeated = [(n, site, key, e) for (key, e) in stats for (site, n) in e['sites'].items() if n >= self.repeats]
+        if repeated:
+            out.append('Possible N+1 patterns (one statement run many times from one place):')
+            for (n, site, key, e) in sorted(repeated, key=lambda item: item[0], reverse=True):
+                out.append('%9.3f %7d  %s: %s' % (e['time'] * n / e['count'], n, site, key[:200]))
+        with open(self.logfile, 'a') as outfile:
+            outfile.write('\n'.join(out) + '\n\n')
+            
+            
+class instrumentedcursor():
+    """ Wraps a cursor so every statement it runs is timed and recorded in a querystats """
+    def __init__(self, curs, stats):
+        self.curs = curs
+        self.stats = stats
+        self.streaming = isinstance(curs, MySQLdb.cursors.SSCursor)
+        self.lastkey = None
+        
+    def execute(self, stmt, args=None):
+        start = time.perf_counter()
+        res = self.curs.execute(stmt, args)
+        # A streaming cursor doesn't know how many rows it has until they're read
+        rows = 0 if self.streaming else self.curs.rowcount
+        self.lastkey = self.stats.record(self.curs, stmt, time.perf_counter() - start, rows)
+        return res
+        
+    def executemany(self, stmt, args):
+        start = time.perf_counter()
+        res = self.curs.executemany(stmt, args)
+        self.stats.record(self.curs, stmt, time.perf_counter() - start, self.curs.rowcount)
+        return res
+        
+    def __iter__(self):
+        if not self.streaming:
+            return iter(self.curs)
+        return self.streamrows()
+        
+    def streamrows(self):
+        """ A streaming cursor does its work as the rows are read, so time that, too """
+        (key, rows, elapsed) = (self.lastkey, 0, 0.0)
+        try:
+            while True:
+                start = time.perf_counter()
+                row = self.curs.fetchone()
+                elapsed += time.perf_counter() - start
+                if row is None:
+                    break
+                rows += 1
+                yield row
+        finally:
+            self.stats.addfetch(key, elapsed, rows)
+        
+    # Special methods are looked up on the class, not through __getattr__
+    def __enter__(self):
+        self.curs.__enter__()
+        return self
+        
+    def __exit__(self, *exc):
+        return self.curs.__exit__(*exc)
+        
+    def __getattr__(self, name):
+        return getattr(self.curs, name)
+    
+    
 class dbconn(Singleton):
-    def __init__(self, dbhost='localhost', dbuser=None, dbpass=None, dbname=None):
+    def __init__(self, dbhost='localhost', dbuser=None, dbpass=None, dbname=None, poolsize=4, querylog=None, explainms=None):
         if self.__dict__.get('conn', False):
             return
+        # Query instrumentation is off unless a log file is named
+        # (Keep collecting into the same stats if we're reconnecting after a close.)
+        self.querystats = self.__dict__.get('querystats') or (querystats(querylog, None if explainms in (None, '') else float(explainms)) if querylog else None)
+        self.pool = []          # Idle connections for workers; see getconnection
+        self.poolsize = poolsize
+        self.poollock = threading.Lock()
         self.dbhost = dbhost 
         self.dbuser = dbuser
         self.dbpass = dbpass
@@ -21,13 +209,44 @@ class dbconn(Singleton):
         #print("Connecting to %s %s with pw %s db %s" % (self.host, self.dbuser, self.dbpassword, self.dbname))
         self.conn = mysql.connect(self.dbhost, self.dbuser, self.dbpass, self.dbname, use_unicode=True, charset='UTF8')
         
-    def cursor(self):
-        return self.conn.cursor()
+    def newconnection(self, dbname=None):
+        """ Open a separate connection with the same parameters (for workers which can't share ours),
+            optionally to a different database on the same server """
+        return mysql.connect(self.dbhost, self.dbuser, self.dbpass, dbname or self.dbname, use_unicode=True, charset='UTF8')
+        
+    def getconnection(self):
+        """ Get a connection for a worker thread from the pool, opening a new one if none is idle.
+            Give it back with putconnection when done. """
+        with self.poollock:
+            if self.pool:
+                return self.pool.pop()
+        return self.newconnection()
+        
+    def putconnection(self, conn):
+        """ Return a connection from getconnection to the pool (or close it if the pool is full) """
+        conn.commit()
+        with self.poollock:
+            if len(self.pool) < self.poolsize:
+                self.pool.append(conn)
+                return
+        conn.close()
+        
+    def cursor(self, streaming=False):
+        if streaming:
+            return streamingcursor(self)
+        curs = self.conn.cursor()
+        if self.querystats:
+            return instrumentedcursor(curs, self.querystats)
+        return curs
         
     def commit(self):
         return self.conn.commit()
         
     def close(self):
+        with self.poollock:
+            for conn in self.pool:
+                conn.close()
+            self.pool = []
         self.conn.close()
         self.conn = None
         
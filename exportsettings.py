@@ -14,8 +14,6 @@ parms = tmparms.tmparms()
 
 # Do global setup
 myglobals.setup(parms)
-curs = myglobals.curs
-conn = myglobals.conn
 
 res = {}
 # Information from the configuration file:
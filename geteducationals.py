@@ -45,9 +45,11 @@ if __name__ == "__main__":
     #   let the datbase do it because we don't have a valid unique key - a person can earn 
     #   identical awards for the same club on the same date.
     existing = set()
-    curs.execute("SELECT membername, clubnumber, award, awarddate FROM awards")
-    for (membername, clubnumber, award, awarddate) in curs.fetchall():
+    awardcurs = conn.cursor(streaming=True)
+    awardcurs.execute("SELECT membername, clubnumber, award, awarddate FROM awards")
+    for (membername, clubnumber, award, awarddate) in awardcurs:
         existing.add(makekey(membername, clubnumber, award, tmutil.stringify(awarddate)))
+    awardcurs.close()
         
     
     # Get the data from Toastmasters
@@ -2,14 +2,29 @@
 """ Get performance information from Toastmasters and write them to files in the work directory.
 
     Unless invoked with --startdate, only gets the latest available information,
-    including club information (unless --skip-clubs is specified).
+    including club information (unless --skip-clubs is specified).  Files whose
+    contents haven't changed are not rewritten; if nothing changed, exits with RC=3.
 
     If invoked with --startdate, gets information and writes files for that date 
     (and, if --enddate is specified, for all available dates through --enddate).
     Does not get club information because it's not available for past dates.
+    Several dates are fetched at once (--jobs) subject to --rate; finished dates are
+    recorded in the --manifest file so that an interrupted run picks up where it stopped.
+
+    With --load, each report is loaded into the database (using loaddb.py's routines)
+    as soon as its file is written, while the remaining reports are still being fetched.
+    When getting historical data, the loads wait until every date has been fetched, so
+    that each table's files are loaded in date order (as loaddb.py would).
 
 """
 
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
 
 import requests
@@ -19,6 +34,127 @@ import tmparms
 from tmutil import cleandate, gotoworkdir
 
 myglobals = tmglobals.tmglobals()
+
+# All requests share one session so connections to Toastmasters are kept alive and reused.
+session = requests.Session()
+session.headers.update({'user-agent': 'curl/7.54.0'})
+
+
+class ratelimiter():
+    """ Space requests at least 1/rate seconds apart, no matter how many threads make them. """
+    def __init__(self, rate=0):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.nexttime = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            mytime = max(now, self.nexttime)
+            self.nexttime = mytime + self.interval
+        time.sleep(mytime - now)
+
+limiter = ratelimiter()
+
+
+class fetchcache():
+    """ Remember what we've fetched so unchanged reports aren't rewritten:
+          * for each URL, the ETag and Last-Modified validators from the server and the file the
+            response went into (so we can make a conditional request and reuse the file on a 304)
+          * for each file, the hash of its contents
+        'changed' becomes True when any file is written. """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.urls = {}
+        self.files = {}
+        self.changed = False
+        if filename and os.path.exists(filename):
+            with open(filename, 'r') as f:
+                info = json.load(f)
+            self.urls = info.get('urls', {})
+            self.files = info.get('files', {})
+
+    def validatorsfor(self, url):
+        """ Return headers for a conditional request for the URL, if we still have its file """
+        info = self.urls.get(url, {})
+        headers = {}
+        if info.get('file') and os.path.exists(info['file']):
+            if info.get('etag'):
+                headers['If-None-Match'] = info['etag']
+            if info.get('lastmodified'):
+                headers['If-Modified-Since'] = info['lastmodified']
+        return headers
+
+    def notevalidators(self, url, responseheaders):
+        info = self.urls.setdefault(url, {})
+        info['etag'] = responseheaders.get('ETag', '')
+        info['lastmodified'] = responseheaders.get('Last-Modified', '')
+
+    def linkfile(self, url, filename):
+        """ Note which file holds the response for the URL """
+        self.urls.setdefault(url, {})['file'] = filename
+
+    def cachedfile(self, url):
+        return self.urls[url]['file']
+
+    def unchanged(self, filename, digest):
+        """ True if the file already exists with contents having this digest """
+        return os.path.exists(filename) and self.files.get(filename) == digest
+
+    def notefile(self, filename, digest):
+        self.files[filename] = digest
+        self.changed = True
+
+    def save(self):
+        if self.filename:
+            with open(self.filename, 'w') as f:
+                json.dump({'urls': self.urls, 'files': self.files}, f, indent=1)
+
+cache = fetchcache()
+
+# With --load, reports are loaded into the database one at a time by 'loader' as they arrive,
+#   using a connection from the pool in 'loadconn' (the dbconn).
+# When backfilling, dates arrive in no particular order, so the loads are put off (in 'deferred')
+#   until everything has been fetched; loading then goes through each table's files in date order.
+loader = None
+loadconn = None
+loads = []
+deferred = None
+
+
+def loadreport(report):
+    """ Queue the table to be loaded from the files in the work directory (if --load was given) """
+    if loader:
+        if deferred is not None:
+            deferred.add(report)
+        else:
+            loads.append(loader.submit(loadtable, report))
+
+
+def finishloads():
+    """ Do any deferred loads and wait for all loads to finish (raising any exception they had) """
+    if loader:
+        if deferred:
+            for report in ('distperf', 'clubperf', 'areaperf'):
+                if report in deferred:
+                    loads.append(loader.submit(loadtable, report))
+        loader.shutdown(wait=True)
+        for load in loads:
+            load.result()
+        loadconn.close()
+
+
+def loadtable(report):
+    import loaddb
+    # If the load fails, the connection isn't given back (so nothing is committed).
+    conn = loadconn.getconnection()
+    if report == 'clubs':
+        loaddb.doHistoricalClubs(conn, myglobals.parms.googlemapsapikey)
+    else:
+        loaddb.doHistorical(conn, report)
+    loadconn.putconnection(conn)
     
 # Map filenames to report names from Toastmasters
 reportnames = {'clubperf':'clubperformance',
@@ -46,30 +182,113 @@ def makeurl(report, district, tmyearpiece="", monthend="", asof=""):
     return url + "~" + monthend + "~" + asof + "~" + tmyearpiece
 
         
-def getresponse(url):
-    headers = {'user-agent': 'curl/7.54.0'}
+class streamedreport():
+    """ A report which has been written to a work file as it arrived instead of being kept in memory """
+    def __init__(self, filename, lastline, digest):
+        self.filename = filename
+        self.lastline = lastline   # The last nonblank line (the "as of" line for performance reports)
+        self.digest = digest       # SHA-256 of the file's contents
+
+
+def splitlines(chunks):
+    """ Turn a stream of text chunks into lines, ignoring carriage returns """
+    pending = ''
+    for chunk in chunks:
+        pending += chunk.replace('\r', '')
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    yield pending
+
+
+def getresponse(url, workfile):
+    """ Stream the response from the URL into 'workfile', checking as it arrives that it's a CSV.
+        Leading and trailing empty lines are dropped.
+        Returns a streamedreport, False if the server answered but had nothing of value for us,
+        or None if we didn't get an answer (a network error or an error status from the server). """
+    limiter.wait()
+    headers = cache.validatorsfor(url)
     try:
-        clubinfo = requests.get(url, headers=headers).text.replace('\r','').split('\n')
-    except requests.exceptions.SSLError:
-        clubinfo = requests.get(url, headers=headers, verify=False).text.replace('\r','').split('\n')
-
-    # Suppress any leading empty lines
-    while not clubinfo[0]:
-        del clubinfo[0]
-    if len(clubinfo) < 10:
+        try:
+            resp = session.get(url, headers=headers, stream=True)
+        except requests.exceptions.SSLError:
+            resp = session.get(url, headers=headers, stream=True, verify=False)
+    except requests.exceptions.RequestException as e:
+        print("Request failed for %s: %s" % (url, e))
+        return None
+    if resp.status_code not in (200, 304):
+        print("Status %d from %s" % (resp.status_code, url))
+        resp.close()
+        return None
+    if resp.status_code == 304:
+        # Not modified since we wrote the file, so use what we have
+        cached = open(cache.cachedfile(url), 'r')
+        chunks = iter(lambda: cached.read(65536), '')
+    else:
+        cache.notevalidators(url, resp.headers)
+        if not resp.encoding:
+            resp.encoding = 'utf-8'
+        chunks = resp.iter_content(chunk_size=65536, decode_unicode=True)
+
+    digest = hashlib.sha256()
+    linecount = 0
+    blanks = 0
+    lastline = ''
+    result = True
+    with open(workfile, 'w') as outfile:
+        for line in splitlines(chunks):
+            if not line.strip():
+                # Hold empty lines until we know they aren't at the end
+                if linecount:
+                    blanks += 1
+                continue
+            if not linecount and line[0] in ['{', '<']:
+                # This isn't a naked CSV
+                print("Not a CSV at", url)
+                result = False
+                break
+            text = '\n' * blanks + line
+            if linecount:
+                text = '\n' + text
+            outfile.write(text)
+            digest.update(text.encode('utf-8'))
+            linecount += 1 + blanks
+            blanks = 0
+            lastline = line
+    resp.close()
+    if resp.status_code == 304:
+        cached.close()
+
+    if result and linecount < 10:
         # We didn't get anything of value
         print("Nothing fetched for", url)
-        clubinfo = False
-    elif clubinfo[0][0] in ['{', '<']:
-        # This isn't a naked CSV
-        print("Not a CSV at", url)
-        clubinfo = False
-    return clubinfo
-        
-        
+        result = False
+    if not result:
+        os.remove(workfile)
+        return False
+    return streamedreport(workfile, lastline, digest.hexdigest())
+
+
+def makeworkfile(report):
+    """ Name a file to stream a report into; unique to this thread """
+    return '%s.%d.part' % (report, threading.get_ident())
+
+
+def savereport(data, filename):
+    """ Put the streamed report into place as 'filename' unless we already have exactly the same thing.
+        Returns True if the file was written. """
+    if cache.unchanged(filename, data.digest):
+        os.remove(data.filename)
+        return False
+    os.replace(data.filename, filename)
+    cache.notefile(filename, data.digest)
+    return True
+
+
 def getreportfromWHQ(report, district, tmyearpiece, month, thedate):
     url = makeurl(report, district, tmyearpiece, getmonthend(month[0],month[1]), datetime.strftime(thedate, '%m/%d/%Y'))
-    resp = getresponse(url)
+    resp = getresponse(url, makeworkfile(report))
     if not resp:
         print("No valid response received for %s" % url)
     return resp
@@ -84,9 +303,11 @@ def gettmyearfordate(d):
         
 def writereportfile(data, report, reportdate, monthend, tmyearpiece):
     if data:
-        with open(makefilename(report, reportdate), 'w') as f:
-            f.write('\n'.join(data))
+        if savereport(data, makefilename(report, reportdate)):
             print('Wrote %s for %s (month: %s, year: %s)' % (report, reportdate, monthend, tmyearpiece))
+            loadreport(report)
+        else:
+            print('Unchanged %s for %s (month: %s, year: %s)' % (report, reportdate, monthend, tmyearpiece))
     else:
         print('No data for %s for %s (month %s, year: %s)' % (report, reportdate, monthend, tmyearpiece))
 
@@ -99,13 +320,12 @@ def getreport(report, district, monthend, tmyearpiece, asof=""):
     reportdate = None
     reportmonthend = None
     url = makeurl(report, district, monthend=monthend, tmyearpiece=tmyearpiece, asof=asof)
-    data = getresponse(url)
+    data = getresponse(url, makeworkfile(report))
 
     if data:
-        while not data[-1].strip():
-            data = data[:-1]
-        dateline = data[-1].replace(',','')
+        dateline = data.lastline.replace(',','')
         reportdate = datetime.strptime(cleandate(dateline.split()[-1]), '%Y-%m-%d').date()  # "Month of Jun, as of 07/02/2015" => '2015-07-02'
+        cache.linkfile(url, makefilename(report, reportdate))
 
         # Figure out the last day of the month for which the report applies
         reportmonth = datetime.strptime(dateline.split()[2], "%b").month  # Extract the month of the report
@@ -118,11 +338,14 @@ def getreport(report, district, monthend, tmyearpiece, asof=""):
     return (data, reportdate, reportmonthend)
     
 def doreportsfor(district, asof):
-    """ Get and write files for the specified date (if available) """
+    """ Get and write files for the specified date (if available).
+        Returns True if we got all three reports, False if WHQ has no data for the date,
+        or None if we couldn't find out (a request failed) or didn't get every report. """
     # Try for the month in question
     tmyearpiece = gettmyearfordate(asof)
     monthend = getmonthend(asof.month, asof.year)
     (data, reportdate, reportmonthend) = getreport('clubperf', district, monthend=monthend, tmyearpiece=tmyearpiece, asof=asof)
+    failed = data is None
     if not data:
         # Need to try the previous month
         if asof.month == 1:
@@ -130,36 +353,96 @@ def doreportsfor(district, asof):
         else:
             monthend = getmonthend(asof.month -1, asof.year)
         (data, reportdate, reportmonthend) = getreport('clubperf', district, monthend=monthend, tmyearpiece=tmyearpiece, asof=asof)
+        failed = failed or data is None
         
         if not data:
             # Need to try for June data from the previous TM year (can't be any farther back)
             monthend = getmonthend(6, asof.year)
             tmyearpiece = gettmyearfordate(date(asof.year, 6, 30))
             (data, reportdate, reportmonthend) = getreport('clubperf', district, monthend=monthend, tmyearpiece=tmyearpiece, asof=asof)
+            failed = failed or data is None
             
     if not data:
         print("Data not available for ", asof.strftime("%Y-%m-%d"))
-    else:
-        writereportfile(data, 'clubperf', reportdate, monthend, tmyearpiece)
-        # and now do the other two reports
-        (data, reportdate, monthend) = getreport('areaperf', district, monthend, tmyearpiece, asof)
-        writereportfile(data, 'areaperf', reportdate, monthend, tmyearpiece)
-        (data, reportdate, monthend) = getreport('distperf', district, monthend, tmyearpiece, asof)
-        writereportfile(data, 'distperf', reportdate, monthend, tmyearpiece)
+        return None if failed else False
+    writereportfile(data, 'clubperf', reportdate, monthend, tmyearpiece)
+    # and now do the other two reports
+    (data, reportdate, monthend) = getreport('areaperf', district, monthend, tmyearpiece, asof)
+    writereportfile(data, 'areaperf', reportdate, monthend, tmyearpiece)
+    gotarea = bool(data)
+    (data, reportdate, monthend) = getreport('distperf', district, monthend, tmyearpiece, asof)
+    writereportfile(data, 'distperf', reportdate, monthend, tmyearpiece)
+    return True if gotarea and data else None
     
     
-def dolatest(district):
+def havereportsfor(asof):
+    """ True if we already have all of the performance files for the date """
+    return all(os.path.exists(makefilename(report, asof)) for report in reportnames)
+
+
+def dobackfill(district, dates, manifest, jobs):
+    """ Get and write files for each of the dates, 'jobs' dates at a time.
+        Dates already listed in the manifest file (or for which we have all the files) are skipped;
+        each date is added to the manifest as soon as all of its reports have been gotten, or
+        (marked "nodata") as soon as WHQ tells us it has no data for the date, so an interrupted
+        run can be resumed.  Dates which failed (perhaps because WHQ was throttling us) aren't
+        added, so they're tried again next time. """
+    done = set()
+    if os.path.exists(manifest):
+        with open(manifest, 'r') as f:
+            done = set(line.split()[0] for line in f if line.strip())
+    todo = [d for d in dates if d.strftime('%Y-%m-%d') not in done and not havereportsfor(d)]
+    print('Getting %d of %d dates' % (len(todo), len(dates)))
+
+    manifestlock = threading.Lock()
+    def doone(d):
+        result = doreportsfor(district, d)
+        if result is None:
+            return
+        with manifestlock:
+            with open(manifest, 'a') as f:
+                f.write(d.strftime('%Y-%m-%d') + ('\n' if result else ' nodata\n'))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for future in [executor.submit(doone, d) for d in todo]:
+            future.result()
+
+
+def dolatest(district, executor):
     """ Get and write files for the latest available from WHQ """
     monthend = ''
     tmyearpiece = ''
     # Note:  We can't fetch areaperf first because we need to give WHQ a valid 'monthend' to get
-    #        back club suspend/charter dates in that report.  
-    for report in ('clubperf', 'areaperf', 'distperf'):
-            (data, reportdate, monthend) = getreport(report, district, monthend, tmyearpiece)
-            if monthend and not tmyearpiece:
-                repmonth = datetime.strptime(monthend, "%m/%d/%Y")
-                tmyearpiece = gettmyearfordate(repmonth)
-            writereportfile(data, report, reportdate, monthend, tmyearpiece)
+    #        back club suspend/charter dates in that report.  Once we have it, the other two
+    #        reports can be fetched at the same time.
+    (data, reportdate, monthend) = getreport('clubperf', district, monthend, tmyearpiece)
+    if monthend:
+        repmonth = datetime.strptime(monthend, "%m/%d/%Y")
+        tmyearpiece = gettmyearfordate(repmonth)
+    writereportfile(data, 'clubperf', reportdate, monthend, tmyearpiece)
+
+    futures = [(report, executor.submit(getreport, report, district, monthend, tmyearpiece))
+               for report in ('areaperf', 'distperf')]
+    for (report, future) in futures:
+        (data, reportdate, reportmonthend) = future.result()
+        writereportfile(data, report, reportdate, reportmonthend, tmyearpiece)
+
+
+def getclubs(district):
+    """ Get and write the current club information """
+    # WHQ doesn't supply date information, but it's always as of yesterday
+    url = "https://www.toastmasters.org/api/sitecore/FindAClub/DownloadCsv?district=%s&advanced=1&latitude=0&longitude=0" % district
+    clubdata = getresponse(url, makeworkfile('clubs'))
+    if clubdata:
+        filename = makefilename('clubs', date.today() - timedelta(1))
+        cache.linkfile(url, filename)
+        if savereport(clubdata, filename):
+            print("Fetched clubs")
+            loadreport('clubs')
+        else:
+            print("Clubs unchanged")
+    else:
+        print('No data received from %s' % url)
 
 
 if __name__ == "__main__":            
@@ -168,30 +451,38 @@ if __name__ == "__main__":
     parms.add_argument('--startdate', default=None)
     parms.add_argument('--enddate', default=None)
     parms.add_argument('--skipclubs', action='store_true', help='Do not get latest club information.')
+    parms.add_argument('--jobs', type=int, default=4, help='Number of dates to get at the same time with --startdate.')
+    parms.add_argument('--rate', type=float, default=2.0, help='Maximum requests per second to Toastmasters with --startdate (0 for no limit).')
+    parms.add_argument('--load', action='store_true', help='Load each report into the database as soon as it has been written.')
+    parms.add_argument('--cachefile', default='fetchcache.json', help='File in the work directory remembering what has been fetched, so unchanged reports are not rewritten.')
+    parms.add_argument('--manifest', default='backfill.manifest', help='File in the work directory listing dates already gotten with --startdate (or which WHQ has no data for); delete it to try them again.')
     
     myglobals.setup(parms, connect=False)
     gotoworkdir()
+    cache = fetchcache(parms.cachefile)
+    if parms.load:
+        import dbconn
+        loadconn = dbconn.dbconn(parms.dbhost, parms.dbuser, parms.dbpass, parms.dbname)
+        loader = ThreadPoolExecutor(max_workers=1)
 
     district = "%0.2d" % int(parms.district)
 
    
     if not parms.startdate:
-        # Get today's data
-        print("Getting the latest performance info")
-        dolatest(district)
-        
-        
-        # And get and write current club data unless told not to
-        # WHQ doesn't supply date information, but it's always as of yesterday
-        if not parms.skipclubs:
-            url = "https://www.toastmasters.org/api/sitecore/FindAClub/DownloadCsv?district=%s&advanced=1&latitude=0&longitude=0" % district
-            clubdata = getresponse(url)
-            if clubdata:
-                with open(makefilename('clubs', date.today() - timedelta(1)), 'w') as f:
-                            f.write('\n'.join(clubdata).replace('\r',''))
-                print("Fetched clubs")
-            else:
-                print('No data received from %s' % url)
+        # Get today's data; the club data doesn't depend on the performance reports,
+        #   so we fetch it at the same time (unless told not to).
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            if not parms.skipclubs:
+                clubsfuture = executor.submit(getclubs, district)
+            print("Getting the latest performance info")
+            dolatest(district, executor)
+            if not parms.skipclubs:
+                clubsfuture.result()
+        finishloads()
+        cache.save()
+        if not cache.changed:
+            print("Nothing new from Toastmasters")
+            sys.exit(3)
 
     else:
         # We are getting historical data
@@ -200,10 +491,16 @@ if __name__ == "__main__":
             enddate = datetime.strptime(cleandate(parms.enddate), '%Y-%m-%d').date()
         else:
             enddate = startdate
-     
+
+        dates = []
         d = startdate
         while d <= enddate:
-            
-            doreportsfor(district, d)
+            dates.append(d)
             d += timedelta(1)
+
+        limiter = ratelimiter(parms.rate)
+        deferred = set()
+        dobackfill(district, dates, parms.manifest, parms.jobs)
+        finishloads()
+        cache.save()
     
@@ -1,15 +1,17 @@
 #!/usr/bin/env python3
 """ Load the performance information already gathered into a database. 
-    Run from the directory containing the YML file for parms and the CSV files 
+    Run from the directory containing the YML file for parms and the CSV files;
+    any zip archives named on the command line are read as well, without extracting them.
     Return code:
        0 if changes were made to the database
        1 if no changes were made """
 
-import csv, dbconn, sys, os, glob
+import csv, dbconn, sys, os, glob, io, zipfile, fnmatch, contextlib
 from simpleclub import Club
 from tmutil import cleandate
 import geocode
 import tmparms, tmglobals
+import populatelastfor, datacalendar
 
 myglobals = tmglobals.tmglobals()
 
@@ -82,7 +84,8 @@ def inform(*args, **kwargs):
     suppress = kwargs.get("suppress", 1)
     file = kwargs.get("file", sys.stderr)
 
-    if parms.quiet < suppress:
+    # Use the global parms so this works when we're imported by another program, too
+    if (getattr(myglobals.parms, "quiet", 0) or 0) < suppress:
         print(" ".join(args), file=file)
 
 
@@ -93,24 +96,37 @@ def normalize(str):
         return ""
 
 
-def different(new, old, headers):
-    """ Returns a list of items which have changed, each of which is a tuple of (item, old, new)."""
-    res = []
-    # Do some type conversions so the comparison works
-    old.latitude = float(old.latitude)
-    old.longitude = float(old.longitude)
+# Marks a value which isn't present in a club at all (as opposed to being empty)
+missing = object()
 
-    for h in headers:
-        try:
-            if new.__dict__[h] != old.__dict__[h]:
-                res.append((h, old.__dict__[h], new.__dict__[h]))
-        except KeyError:
+
+def snapshot(club, headers):
+    """ Return the club's values for 'headers' as a tuple, so that an unchanged club
+        can be recognized with a single comparison.  Latitude and longitude are
+        compared as numbers. """
+    values = [club.__dict__.get(h, missing) for h in headers]
+    for (i, h) in enumerate(headers):
+        if h in ("latitude", "longitude") and values[i] is not missing:
+            values[i] = float(values[i])
+    return tuple(values)
+
+
+def changedcells(new, old, headers):
+    """ Given snapshots of the new and old versions of a club, return the list of
+        (item, old, new) tuples for the items which have changed. """
+    if new == old:
+        return []
+    res = []
+    for (h, n, o) in zip(headers, new, old):
+        if n is missing or o is missing:
             if h not in headersnotinboth:
-                if h not in new.__dict__:
+                if n is missing:
                     sys.stdout.write("%s not in new headers\n" % h)
                 else:
                     sys.stdout.write("%s not in old headers\n" % h)
                 headersnotinboth.append(h)
+        elif n != o:
+            res.append((h, o, n))
     return res
 
 
@@ -131,29 +147,75 @@ def cleanitem(item):
     return item
 
 
-def doHistoricalClubs(conn, mapkey):
-    clubfiles = glob.glob("clubs.*.csv")
-    clubfiles.sort()
+@contextlib.contextmanager
+def findfiles(pattern, archives=()):
+    """ Find files matching 'pattern' in the current directory and as members of the
+        zip archives (such as hist2019.zip).  Use in a 'with' statement, which gives a list of
+        (filename, source) tuples sorted by filename (and therefore by date); 'source' is what
+        openfile needs.  Each archive is opened once and closed at the end of the 'with'.
+        If a file is in both places, the one in the current directory wins. """
+    with contextlib.ExitStack() as archivestack:
+        found = {}
+        for path in archives:
+            zf = archivestack.enter_context(zipfile.ZipFile(path))
+            for member in zf.namelist():
+                filename = os.path.basename(member)
+                if fnmatch.fnmatch(filename, pattern):
+                    found[filename] = (zf, member)
+        for filename in glob.glob(pattern):
+            found[filename] = filename
+        yield sorted(found.items())
+
+
+def openfile(source):
+    """ Open a source from findfiles for reading as text.  An archive member is decompressed
+        once, into memory (not onto disk), so getasof can read its end and the loader can then
+        read it from the start without decompressing it again. """
+    if isinstance(source, tuple):
+        (zf, member) = source
+        return io.TextIOWrapper(io.BytesIO(zf.read(member)))
+    return open(source, "r")
+
+
+def getloaded(conn, tablename):
+    """ Return the set of dates (as 'YYYY-MM-DD' strings) already loaded for the table """
     curs = conn.cursor()
-    firsttime = True
+    curs.execute("SELECT loadedfor FROM loaded WHERE tablename=%s", (tablename,))
+    return set("%s" % l[0] for l in curs.fetchall())
 
-    for c in clubfiles:
-        cdate = c.split(".")[1]
-        curs.execute(
-            'SELECT COUNT(*) FROM loaded WHERE tablename="clubs" AND loadedfor=%s',
-            (cdate,),
-        )
-        if curs.fetchone()[0] > 0:
-            continue
-        infile = open(c, "r")
-        doDailyClubs(infile, conn, cdate, firsttime)
-        firsttime = False
-        infile.close()
-        conn.commit()
+
+def notloaded(conn, archives=()):
+    """ Return the names of the files (clubs and performance) which haven't been loaded """
+    names = []
+    for name in ("clubs", "distperf", "clubperf", "areaperf"):
+        loaded = getloaded(conn, name)
+        with findfiles(name + ".*.csv", archives) as files:
+            names.extend(c for (c, source) in files if c.split(".")[1] not in loaded)
+    return names
+
+
+def doHistoricalClubs(conn, mapkey, archives=(), updategeo=True):
+    curs = conn.cursor()
+    firsttime = True
+    loaded = getloaded(conn, "clubs")
+
+    with findfiles("clubs.*.csv", archives) as files:
+        for (c, source) in files:
+            cdate = c.split(".")[1]
+            if cdate in loaded:
+                continue
+            infile = openfile(source)
+            doDailyClubs(infile, conn, cdate, firsttime)
+            firsttime = False
+            infile.close()
+            conn.commit()
 
     # Commit all changes
     conn.commit()
 
+    if not updategeo:
+        return
+
     # And update the GEO table if necessary
     curs.execute("SELECT MAX(lastdate) FROM clubs")
     lastdate = curs.fetchone()[0]
@@ -245,6 +307,13 @@ def doDailyClubs(infile, conn, cdate, firsttime=False):
     )
     clubhist = Club.getClubsOn(curs, date=yesterday)
 
+    # Take yesterday's values once so each club can be checked with one comparison
+    compareheaders = dbheaders[:-2]
+    histvalues = {
+        clubnumber: snapshot(clubhist[clubnumber], compareheaders)
+        for clubnumber in clubhist
+    }
+
     for row in reader:
         if len(row) < expectedheaderscount:
             break  # we're finished
@@ -354,8 +423,11 @@ def doDailyClubs(infile, conn, cdate, firsttime=False):
             (club.latitude, club.longitude) = (club.longitude, club.latitude)
 
         # And put it into the database if need be
+        clubvalues = snapshot(club, compareheaders)
         if club.clubnumber in clubhist:
-            changes = different(club, clubhist[club.clubnumber], dbheaders[:-2])
+            changes = changedcells(
+                clubvalues, histvalues[club.clubnumber], compareheaders
+            )
         else:
             changes = []
 
@@ -401,9 +473,7 @@ def doDailyClubs(infile, conn, cdate, firsttime=False):
                 except Exception as e:
                     print(e)
             clubhist[club.clubnumber] = club
-            if different(club, clubhist[club.clubnumber], dbheaders[:-2]):
-                print("it's different after being set.")
-                sys.exit(3)
+            histvalues[club.clubnumber] = clubvalues
         else:
             # update the lastdate
             changecount += curs.execute(
@@ -418,81 +488,158 @@ def doDailyClubs(infile, conn, cdate, firsttime=False):
     )
 
 
-def getasof(infile):
+def insertrows(curs, tablename, headers, rows):
+    """ Insert all of the rows (each a list of values in 'headers' order) into the table using
+        INSERT IGNORE.  MySQLdb turns executemany into multi-row INSERTs, so a whole file
+        goes to the database in a handful of round trips instead of one per row.
+        Returns the number of rows actually inserted. """
+    if not rows:
+        return 0
+    stmt = "INSERT IGNORE INTO %s (%s) VALUES (%s)" % (
+        tablename,
+        ",".join(headers),
+        ",".join(["%s" for each in headers]),
+    )
+    return curs.executemany(stmt, rows)
+
+
+def parseasof(line):
+    """ Parse a "Month of Jun, As of 07/02/2015" trailer line into (monthstart, date) """
+    (mpart, dpart) = line.split(",")
+    month = 1 + [
+        "jan",
+        "feb",
+        "mar",
+        "apr",
+        "may",
+        "jun",
+        "jul",
+        "aug",
+        "sep",
+        "oct",
+        "nov",
+        "dec",
+    ].index(mpart.split()[-1].lower()[0:3])
+    date = cleandate(dpart.split()[-1])
+    asofyear = int(date[0:4])
+    asofmon = int(date[5:7])
+    if month == 12 and asofmon == 1:
+        asofyear = asofyear - 1
+    monthstart = "%04d-%02d-%02d" % (asofyear, month, 1)
+    return (monthstart, date)
+
+
+def getasof(infile, tailsize=4096):
     """ Gets the "as of" information from a Toastmasters' report.  
         Returns a tuple: (monthstart, date) (both as characters)
         If there is no "as of" information, returns False.
         Seeks the file back to the current position.
+
+        The "as of" line is at the end of the report, so we read the last 'tailsize' bytes
+        through the file's own buffer instead of reading the whole file; if the line isn't
+        there (or the file has no byte buffer), we scan the file from the current position.
         """
     retval = False
     filepos = infile.tell()
-    for line in infile:
-        if not line:
-            break
-        if not line.startswith("Month of"):
-            continue
-        (mpart, dpart) = line.split(",")
-        month = 1 + [
-            "jan",
-            "feb",
-            "mar",
-            "apr",
-            "may",
-            "jun",
-            "jul",
-            "aug",
-            "sep",
-            "oct",
-            "nov",
-            "dec",
-        ].index(mpart.split()[-1].lower()[0:3])
-        date = cleandate(dpart.split()[-1])
-        asofyear = int(date[0:4])
-        asofmon = int(date[5:7])
-        if month == 12 and asofmon == 1:
-            asofyear = asofyear - 1
-        monthstart = "%04d-%02d-%02d" % (asofyear, month, 1)
-
-        retval = (monthstart, date)
-        break
+    buf = getattr(infile, "buffer", None)
+    if buf is not None:
+        buf.seek(0, os.SEEK_END)
+        buf.seek(max(0, buf.tell() - tailsize))
+        tail = buf.read().decode(infile.encoding or "utf-8", errors="replace")
+        for line in reversed(tail.splitlines()):
+            if line.startswith("Month of"):
+                retval = parseasof(line)
+                break
+    if not retval:
+        infile.seek(filepos)
+        for line in infile:
+            if not line:
+                break
+            if line.startswith("Month of"):
+                retval = parseasof(line)
+                break
     infile.seek(filepos)
     return retval
 
 
-def doHistorical(conn, name):
+def doHistorical(conn, name, markentries=True, archives=()):
+    """ Load any new files for the named performance table.
+        Returns (loadedfor, since, prevmonth):  a dictionary mapping each date loaded to its
+        monthstart, and the latest asof and monthstart in the table before loading. """
     inform("Processing", name, suppress=2)
-    perffiles = glob.glob(name + ".*.csv")
-    perffiles.sort()
+    loaded = getloaded(conn, name)
     curs = conn.cursor()
-    for c in perffiles:
-        infile = open(c, "r")
-        (monthstart, cdate) = getasof(infile)
-        # Table names can't be dynamically substituted by the MySQLdb module, so we do that ourselves.
-        # We let MySQLdb substitute the date, since that comes from outside sources and needs to be protected against.
-        curs.execute(
-            'SELECT COUNT(*) FROM loaded WHERE tablename="%s" AND loadedfor=%%s' % name,
-            (cdate,),
-        )
-        if curs.fetchone()[0] == 0:
-            # Don't have data for this date; call the appropriate routine.
-            if name == "distperf":
-                doDailyDistrictPerformance(infile, conn, cdate, monthstart)
-            elif name == "areaperf":
-                doDailyAreaPerformance(infile, conn, cdate, monthstart)
-            elif name == "clubperf":
-                doDailyClubPerformance(infile, conn, cdate, monthstart)
-            else:
-                sys.stderr.write(
-                    "'%s' is not a valid name for historical performance requests."
-                )
-                sys.exit(1)
-        infile.close()
+    curs.execute("SELECT MAX(asof), MAX(monthstart) FROM %s" % name)
+    (since, prevmonth) = curs.fetchone()
+    loadedfor = {}
+    with findfiles(name + ".*.csv", archives) as files:
+        for (c, source) in files:
+            # Files are named for their "as of" date, so we can skip loaded ones without opening them.
+            if c.split(".")[1] in loaded:
+                continue
+            infile = openfile(source)
+            (monthstart, cdate) = getasof(infile)
+            if cdate not in loaded:
+                # Don't have data for this date; call the appropriate routine.
+                if name == "distperf":
+                    doDailyDistrictPerformance(infile, conn, cdate, monthstart)
+                elif name == "areaperf":
+                    doDailyAreaPerformance(infile, conn, cdate, monthstart)
+                elif name == "clubperf":
+                    doDailyClubPerformance(infile, conn, cdate, monthstart)
+                else:
+                    sys.stderr.write(
+                        "'%s' is not a valid name for historical performance requests."
+                    )
+                    sys.exit(1)
+                loaded.add(cdate)
+                loadedfor[cdate] = monthstart
+            infile.close()
+
+    if markentries:
+        finishtable(conn, name, loadedfor, since, prevmonth)
+    return (loadedfor, since, prevmonth)
+
+
+def finishtable(conn, name, loadedfor, since, prevmonth, remark=False):
+    """ Set the entrytypes and bring the lastfor table up-to-date after loading the named table
+        (see doHistorical for 'loadedfor', 'since', and 'prevmonth'). """
+    markentrytypes(conn, name, None if remark else set(loadedfor.values()), since, prevmonth)
+    populatelastfor.updatetable(conn.cursor(), name, loadedfor, since, prevmonth)
+    conn.commit()
+    if name == "clubperf":
+        # Keep the data availability calendar (used by require.py) in step with the database
+        datacalendar.writecalendar(conn.cursor(), datacalendar.calendarfile(myglobals.parms))
+
+
+def markentrytypes(conn, name, months=None, since=None, prevmonth=None):
+    """ Set the entrytype ('M', 'D', 'L') for the named performance table.
+        If 'months' is given, only entries for those months (and 'prevmonth', the month which
+        was the latest before this run) can become month-final; otherwise, all history is checked.
+        'since' is the latest asof before this run. """
+    curs = conn.cursor()
+    curs.execute("SELECT max(asof) FROM %s" % name)
+    maxasof = curs.fetchone()[0]
+
+    monthfilter = ""
+    params = None
+    if months is not None:
+        if not months and maxasof == since:
+            return  # Nothing new was loaded, so the entrytypes are already right.
+        # The previous latest month couldn't be marked until a later month arrived,
+        # so it may need marking now even if we loaded nothing for it.
+        params = set("%s" % m for m in months)
+        if prevmonth:
+            params.add("%s" % prevmonth)
+        params = sorted(params)
+        monthfilter = "AND monthstart IN (%s)" % ",".join(["%s" for each in params])
 
     # Set 'final for month' indications for the appropriate items:
     #   For each club, set the indicator for the last entry for a month OTHER than the most recent month
 
-    curs.execute(
-        """
+    if params is None or params:
+        curs.execute(
+            """
     UPDATE %s 
     SET    entrytype = 'M' 
     WHERE  id IN (SELECT id 
@@ -505,6 +652,7 @@ def doHistorical(conn, name):
                                              WHERE  monthstart != 
                                                     (SELECT Max(monthstart) 
                                                      FROM   %s) 
+                                                    %s
                                              GROUP  BY clubnumber, 
                                                        monthstart) latest 
                                          ON %s.clubnumber = latest.clubnumber 
@@ -512,13 +660,12 @@ def doHistorical(conn, name):
                                                 latest.maxasofformonth
                                                 AND entrytype <> 'M') 
                          updates)"""
-        % (name, name, name, name, name, name)
-    )
+            % (name, name, name, name, monthfilter, name, name),
+            params,
+        )
 
     # Now, mark the latest daily entry
     curs.execute("UPDATE %s SET entrytype = 'D' WHERE entrytype = 'L'" % name)
-    curs.execute("SELECT max(asof) FROM %s" % name)
-    maxasof = curs.fetchone()[0]
     curs.execute(
         "UPDATE %s SET entrytype = 'L' WHERE entrytype = 'D' AND asof = %%s" % name,
         (maxasof,),
@@ -527,6 +674,20 @@ def doHistorical(conn, name):
     conn.commit()
 
 
+# Suspensions already in clubchanges, as a set of (clubnumber, suspenddate) for each connection
+knownsuspensions = {}
+
+
+def getsuspensions(conn):
+    """ Return the set of suspensions already recorded in clubchanges; it's only read from
+        the database the first time for each connection and is kept up-to-date by the caller. """
+    if conn not in knownsuspensions:
+        curs = conn.cursor()
+        curs.execute('SELECT clubnumber, new FROM clubchanges WHERE item="Suspended"')
+        knownsuspensions[conn] = set(("%d" % c[0], c[1]) for c in curs.fetchall())
+    return knownsuspensions[conn]
+
+
 def doDailyDistrictPerformance(infile, conn, cdate, monthstart):
     global changecount
     curs = conn.cursor()
@@ -565,8 +726,9 @@ def doDailyDistrictPerformance(infile, conn, cdate, monthstart):
     districtcol = headers.index("district")
     # We're going to use the last column for the effective date of the data
     headers.append("asof")
-    valstr = ",".join(["%s" for each in headers])
-    headstr = ",".join(headers)
+    rows = []
+    suspensions = getsuspensions(conn)
+    newsuspensions = []
     for row in reader:
         if row[0].startswith("Month"):
             break
@@ -589,25 +751,20 @@ def doDailyDistrictPerformance(infile, conn, cdate, monthstart):
         except ValueError:
             suspdate = ""
         row = row[:cdsdcol] + [charterdate, suspdate] + row[cdsdcol + 1 :]
-
-        changecount += curs.execute(
-            "INSERT IGNORE INTO distperf (" + headstr + ") VALUES (" + valstr + ")", row
-        )
+        rows.append(row)
 
         # If this item represents a suspended club, and it's the first time we've seen this suspension,
         # add it to the clubchanges database
-        if suspdate:
-            curs.execute(
-                'SELECT * FROM clubchanges WHERE clubnumber=%s and item="Suspended" and new=%s',
-                (clubnumber, suspdate),
-            )
-            if not curs.fetchone():
-                # Add this suspension
-                curs.execute(
-                    'INSERT IGNORE INTO clubchanges (item, old, new, clubnumber, changedate) VALUES ("Suspended", "", %s, %s, %s)',
-                    (suspdate, clubnumber, cdate),
-                )
-
+        if suspdate and (clubnumber, suspdate) not in suspensions:
+            suspensions.add((clubnumber, suspdate))
+            newsuspensions.append((suspdate, clubnumber, cdate))
+
+    changecount += insertrows(curs, "distperf", headers, rows)
+    if newsuspensions:
+        curs.executemany(
+            'INSERT IGNORE INTO clubchanges (item, old, new, clubnumber, changedate) VALUES ("Suspended", "", %s, %s, %s)',
+            newsuspensions,
+        )
     conn.commit()
     # Now, insert the month into all of today's entries
     curs.execute(
@@ -644,6 +801,7 @@ def doDailyClubPerformance(infile, conn, cdate, monthstart):
     inform("clubperf for", cdate, supress=1)
     areacol = headers.index("area")
     districtcol = headers.index("district")
+    statuscol = headers.index("clubstatus")
     memcol = headers.index("activemembers")
     otr1col = headers.index("offtrainedround1")
     otr2col = headers.index("offtrainedround2")
@@ -656,8 +814,7 @@ def doDailyClubPerformance(infile, conn, cdate, monthstart):
     headers.append("color")
     headers.append("goal9")
     headers.append("goal10")
-    valstr = ",".join(["%s" for each in headers])
-    headstr = ",".join(headers)
+    rows = []
     for row in reader:
         if row[0].startswith("Month"):
             break
@@ -666,7 +823,6 @@ def doDailyClubPerformance(infile, conn, cdate, monthstart):
         row[areacol] = cleanitem(row[areacol])
         row[clubcol] = cleanitem(row[clubcol])
         row[districtcol] = cleanitem(row[districtcol])
-        clubnumber = row[clubcol]
         # Compute Colorcode
         members = int(row[memcol])
         if members <= 12:
@@ -690,23 +846,46 @@ def doDailyClubPerformance(infile, conn, cdate, monthstart):
         else:
             row.append(0)
 
-        changecount += curs.execute(
-            "INSERT IGNORE INTO clubperf (" + headstr + ") VALUES (" + valstr + ")", row
+        rows.append(row)
+
+    changecount += insertrows(curs, "clubperf", headers, rows)
+
+    # Let's see if the club status has changed; if so, indicate that in the clubchanges table.
+    # We compare against the previous snapshot in memory instead of querying each club's history.
+    curs.execute(
+        'SELECT MAX(loadedfor) FROM loaded WHERE tablename="clubperf" AND loadedfor < %s',
+        (cdate,),
+    )
+    prevdate = curs.fetchone()[0]
+    prevstatus = {}
+    if prevdate:
+        curs.execute(
+            "SELECT clubnumber, clubstatus FROM clubperf WHERE asof = %s", (prevdate,)
         )
+        prevstatus = {"%d" % c[0]: c[1] for c in curs.fetchall()}
 
-        # Let's see if the club status has changed; if so, indicate that in the clubchanges table.
+    # Clubs not in the previous snapshot (all of them, if there isn't one) are compared against
+    #   their most recent earlier entry, if any; get those in one query.
+    missing = sorted(set(row[clubcol] for row in rows) - set(prevstatus))
+    if missing:
         curs.execute(
-            "SELECT clubstatus, asof FROM clubperf WHERE clubnumber=%s ORDER BY ASOF DESC LIMIT 2 ",
-            (clubnumber,),
+            "SELECT clubperf.clubnumber, clubperf.clubstatus FROM clubperf INNER JOIN (SELECT clubnumber, MAX(asof) AS m FROM clubperf WHERE asof < %s AND clubnumber IN ("
+            + ",".join(["%s"] * len(missing))
+            + ") GROUP BY clubnumber) latest ON clubperf.clubnumber = latest.clubnumber AND clubperf.asof = latest.m",
+            [cdate] + missing,
+        )
+        prevstatus.update({"%d" % c[0]: c[1] for c in curs.fetchall()})
+
+    statuschanges = []
+    for row in rows:
+        clubnumber = row[clubcol]
+        if clubnumber in prevstatus and prevstatus[clubnumber] != row[statuscol]:
+            statuschanges.append((prevstatus[clubnumber], row[statuscol], clubnumber, cdate))
+    if statuschanges:
+        curs.executemany(
+            'INSERT IGNORE INTO clubchanges (item, old, new, clubnumber, changedate) VALUES ("Status Change", %s, %s, %s, %s)',
+            statuschanges,
         )
-        ans = curs.fetchall()
-        if len(ans) == 2:
-            if ans[0][0] != ans[1][0]:
-                curs2 = conn.cursor()
-                curs2.execute(
-                    'INSERT IGNORE INTO clubchanges (item, old, new, clubnumber, changedate) VALUES ("Status Change", %s, %s, %s, %s)',
-                    (ans[1][0], ans[0][0], clubnumber, cdate),
-                )
 
     conn.commit()
     # Now, insert the month into all of today's entries
@@ -744,8 +923,7 @@ def doDailyAreaPerformance(infile, conn, cdate, monthstart):
 
     # We're going to use the last column for the effective date of the data
     headers.append("asof")
-    valstr = ",".join(["%s" for each in headers])
-    headstr = ",".join(headers)
+    rows = []
     for row in reader:
         if row[0].startswith("Month"):
             break
@@ -770,11 +948,9 @@ def doDailyAreaPerformance(infile, conn, cdate, monthstart):
         except ValueError:
             suspdate = ""
         row = row[:cdsdcol] + [charterdate, suspdate] + row[cdsdcol + 1 :]
+        rows.append(row)
 
-        changecount += curs.execute(
-            "INSERT IGNORE INTO areaperf (" + headstr + ") VALUES (" + valstr + ")", row
-        )
-
+    changecount += insertrows(curs, "areaperf", headers, rows)
     conn.commit()
     # Now, insert the month into all of today's entries
     curs.execute(
@@ -787,22 +963,137 @@ def doDailyAreaPerformance(infile, conn, cdate, monthstart):
     conn.commit()
 
 
+# Tables which are completely rebuilt from the CSV files by --rebuild
+rebuildtables = ("clubs", "clubperf", "areaperf", "distperf", "lastfor", "loaded", "clubchanges")
+# The date column showing how far each rebuilt table reaches.  clubchanges isn't checked;
+#   it can be empty after a good rebuild.
+rebuildcheck = {"clubs": "lastdate", "clubperf": "asof", "areaperf": "asof", "distperf": "asof",
+                "lastfor": "asof", "loaded": "loadedfor"}
+
+
+def checkrebuild(curs, dbname, shadowdb):
+    """ Return a list of the reasons the rebuilt tables shouldn't replace the live ones:
+        a table with no rows, or one which doesn't reach as far as the live table does. """
+    problems = []
+    for (t, col) in rebuildcheck.items():
+        curs.execute("SELECT COUNT(*), MAX(%s) FROM %s.%s" % (col, shadowdb, t))
+        (count, newlast) = curs.fetchone()
+        curs.execute("SELECT MAX(%s) FROM %s.%s" % (col, dbname, t))
+        oldlast = curs.fetchone()[0]
+        if not count:
+            problems.append("%s is empty" % t)
+        elif oldlast and newlast < oldlast:
+            problems.append("%s only goes to %s; the live table goes to %s" % (t, newlast, oldlast))
+    return problems
+
+
+def rebuild(conn, dbname, shadowdb, archives=()):
+    """ Load everything into empty copies of the tables in the shadow database, then swap them
+        into place with a single RENAME TABLE so readers never see a half-built database.
+        If the rebuilt tables are missing data (see checkrebuild), they're left in the shadow
+        database and the live tables are untouched; returns True if the swap was made. """
+    curs = conn.cursor()
+    curs.execute("CREATE DATABASE IF NOT EXISTS %s" % shadowdb)
+    for t in rebuildtables:
+        curs.execute("DROP TABLE IF EXISTS %s.%s" % (shadowdb, t))
+        # A swap that failed before its cleanup would leave these behind and block the next RENAME.
+        curs.execute("DROP TABLE IF EXISTS %s.%s_old" % (shadowdb, t))
+        curs.execute("CREATE TABLE %s.%s LIKE %s.%s" % (shadowdb, t, dbname, t))
+
+    # The loaders use unqualified table names, so we just point them at the shadow database.
+    # The GEO table isn't rebuilt; the next normal run brings it up to date.
+    shadow = myglobals.conn.newconnection(shadowdb)
+    inform("Rebuilding in", shadowdb, suppress=1)
+    doHistoricalClubs(shadow, None, archives, updategeo=False)
+    for name in ("distperf", "clubperf", "areaperf"):
+        doHistorical(shadow, name, archives=archives)
+    shadowcurs = shadow.cursor()
+    populatelastfor.doit(shadowcurs, parms)
+    shadow.commit()
+    shadow.close()
+
+    problems = checkrebuild(curs, dbname, shadowdb)
+    if problems:
+        for p in problems:
+            print("Rebuild not used:", p, file=sys.stderr)
+        return False
+
+    # RENAME TABLE handles all of the tables atomically.
+    renames = []
+    for t in rebuildtables:
+        renames.append("%s.%s TO %s.%s_old" % (dbname, t, shadowdb, t))
+        renames.append("%s.%s TO %s.%s" % (shadowdb, t, dbname, t))
+    curs.execute("RENAME TABLE " + ", ".join(renames))
+    for t in rebuildtables:
+        curs.execute("DROP TABLE %s.%s_old" % (shadowdb, t))
+    conn.commit()
+    return True
+
+
+def loadstream(name):
+    """ Load one stream ('clubs' or a performance table) on its own database connection.
+        Used as the worker for --jobs; returns the number of changes made and, for
+        performance tables, what doHistorical returns. """
+    global changecount
+    changecount = 0
+    result = None
+    conn = myglobals.conn.newconnection()
+    if name == "clubs":
+        doHistoricalClubs(conn, parms.googlemapsapikey, parms.archives)
+    else:
+        result = doHistorical(conn, name, markentries=False, archives=parms.archives)
+    conn.close()
+    return (changecount, result)
+
+
 if __name__ == "__main__":
 
     # Handle parameters
     parms = tmparms.tmparms()
     parms.add_argument("--quiet", "-q", action="count", default=0)
+    parms.add_argument("--jobs", "-j", type=int, default=1, help="Number of streams (clubs, distperf, clubperf, areaperf) to load at the same time")
+    parms.add_argument("--remark", action="store_true", help="Recompute entrytypes over all history instead of only the months loaded in this run")
+    parms.add_argument("--rebuild", action="store_true", help="Rebuild the tables from scratch in a shadow database and swap them in when done")
+    parms.add_argument("--shadowdb", default="", help="Database to use for --rebuild (default: the database name + '_rebuild')")
+    parms.add_argument("--calendar", default=datacalendar.defaultfile, help="Data availability calendar to write when done (used by require.py)")
+    parms.add_argument("--checkloaded", action="store_true", help="Don't load anything; exit with 0 if every file has been loaded, 3 if some haven't")
+    parms.add_argument("archives", nargs="*", default=[], help="Zip archives (such as hist2019.zip) to load from in addition to the current directory")
 
     # Do global setup
     myglobals.setup(parms)
     conn = myglobals.conn
 
-    inform("Processing Clubs", supress=1)
-    doHistoricalClubs(conn, parms.googlemapsapikey)
-    doHistorical(conn, "distperf")
-    doHistorical(conn, "clubperf")
-    doHistorical(conn, "areaperf")
+    if parms.checkloaded:
+        waiting = notloaded(conn, parms.archives)
+        if waiting:
+            inform("Not loaded:", ", ".join(waiting))
+        conn.close()
+        sys.exit(3 if waiting else 0)
+
+    perftables = ("distperf", "clubperf", "areaperf")
+    if parms.rebuild:
+        if not rebuild(conn, parms.dbname, parms.shadowdb or parms.dbname + "_rebuild", parms.archives):
+            sys.exit(2)
+    elif parms.jobs > 1:
+        # The four streams share no rows, so each gets its own worker and connection.
+        # Setting entrytypes and updating lastfor waits until all of them are done.
+        # The workers (loadstream) use our parms and myglobals, so they must be forked, not spawned.
+        import multiprocessing
+
+        inform("Processing Clubs and", ", ".join(perftables), suppress=1)
+        with multiprocessing.get_context("fork").Pool(min(parms.jobs, 1 + len(perftables))) as pool:
+            results = pool.map(loadstream, ("clubs",) + perftables)
+        changecount += sum(r[0] for r in results)
+        for (name, (count, (loadedfor, since, prevmonth))) in zip(perftables, results[1:]):
+            finishtable(conn, name, loadedfor, since, prevmonth, parms.remark)
+    else:
+        inform("Processing Clubs", supress=1)
+        doHistoricalClubs(conn, parms.googlemapsapikey, parms.archives)
+        for name in perftables:
+            (loadedfor, since, prevmonth) = doHistorical(conn, name, markentries=False, archives=parms.archives)
+            finishtable(conn, name, loadedfor, since, prevmonth, parms.remark)
 
+    datacalendar.writecalendar(conn.cursor(), parms.calendar)
     conn.close()
 
     if changecount == 0:
@@ -23,8 +23,6 @@ if __name__ == "__main__":
 
     # Do global setup
     myglobals.setup(parms, sections='alignment')
-    conn = myglobals.conn
-    curs = myglobals.curs
 
     os.chdir(parms.outdir)
 
@@ -50,8 +50,6 @@ if __name__ == "__main__":
 
     # Do global setup
     myglobals.setup(parms)
-    curs = myglobals.curs
-    conn = myglobals.conn
 
     # Start by getting alignment from the DEC file
     reader = csv.DictReader(open(parms.decfile, 'r'))
@@ -46,8 +46,6 @@ if __name__ == "__main__":
 
     # Do global setup
     myglobals.setup(parms)
-    curs = myglobals.curs
-    conn = myglobals.conn
 
     outfile = codecs.open(parms.outfile, 'w', 'utf-8', errors='ignore')
     outfile.write('<table id="guides">\n')
@@ -15,6 +15,94 @@ def dotable(curs, name, tmyear):
     res = [r for r in curs.fetchall()]
     return res
 
+def tmyearof(monthstart):
+    """ Return the TM year (as the starting year) for a date """
+    return monthstart.year if monthstart.month >= 7 else monthstart.year - 1
+
+
+def lastentry(curs, name, clubnumber, tmyear):
+    """ The club's last month-final or latest entry in the named table for the year, as a list of
+        zero or one (clubnumber, id, asof, monthstart) rows """
+    curs.execute("SELECT clubnumber, id, asof, monthstart FROM " + name + " WHERE clubnumber = %s AND entrytype in ('M', 'L') AND monthstart >= %s AND monthstart <= %s ORDER BY asof DESC LIMIT 1",
+                 (clubnumber, '%d-07-01' % tmyear, '%d-06-01' % (tmyear + 1)))
+    return curs.fetchall()
+
+
+def upsertrows(curs, name, rows, tmyear):
+    """ Set the named table's id (and, for distperf, the asof and monthstart) for the
+        (clubnumber, id, asof, monthstart) rows in lastfor; clubs with no distperf entry
+        are ignored """
+    if name == 'distperf':
+        curs.execute('SELECT clubnumber FROM lastfor WHERE tmyear = %s', (tmyear,))
+        known = set(r[0] for r in curs.fetchall())
+        stmt = "INSERT INTO lastfor (clubnumber, clubperf_id, areaperf_id, distperf_id, asof, monthstart, tmyear) VALUES (%s, 0, 0, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE distperf_id=VALUES(distperf_id), asof=VALUES(asof), monthstart=VALUES(monthstart)"
+        curs.executemany(stmt, [(c, id, asof, monthstart, tmyear) for (c, id, asof, monthstart) in rows])
+        # clubperf and areaperf may have been loaded first; pick up their entries for new clubs,
+        #   as a full rebuild would.
+        for (c, id, asof, monthstart) in rows:
+            if c not in known:
+                for other in ('clubperf', 'areaperf'):
+                    found = lastentry(curs, other, c, tmyear)
+                    if found:
+                        curs.execute('UPDATE lastfor SET ' + other + '_id = %s WHERE clubnumber = %s AND tmyear = %s', (found[0][1], c, tmyear))
+    else:
+        # Only clubs already in lastfor (from distperf) get an entry, just as in a full rebuild.
+        col = name + '_id'
+        stmt = "UPDATE lastfor SET " + col + " = %s WHERE clubnumber = %s AND tmyear = %s"
+        curs.executemany(stmt, [(id, c, tmyear) for (c, id, asof, monthstart) in rows])
+
+
+def updatetable(curs, name, loadedfor, since, prevmonth=None):
+    """ Bring lastfor up-to-date for the named table after loading.  Call after the entrytypes have been set.
+          loadedfor maps each date just loaded to its monthstart (both 'yyyy-mm-dd')
+          since is the latest asof in the table before loading (None if it was empty)
+          prevmonth is the latest monthstart in the table before loading (None if it was empty)
+        Normally, only clubs with new entries (or whose entry is no longer final) are touched;
+        if older dates were filled in, the years involved are recomputed for this table. """
+    if not loadedfor:
+        return
+    col = name + '_id'
+    since = '%s' % since if since else '1900-01-01'
+
+    if min(loadedfor) <= since:
+        # Filling in history:  recompute this table's part of each year involved
+        years = set(tmyearof(datetime.datetime.strptime(m, '%Y-%m-%d')) for m in loadedfor.values())
+        for y in sorted(years):
+            if name != 'distperf':
+                curs.execute('UPDATE lastfor SET ' + col + ' = 0 WHERE tmyear = %s', (y,))
+            upsertrows(curs, name, dotable(curs, name, y), y)
+        return
+
+    # Everything loaded is newer than anything lastfor points to, so the newest month-final or latest
+    #   entry for each club in each year among the new entries is the one we want.  Entries in the
+    #   months marked for this load (the previous latest month in particular) may have just become
+    #   month-final, too:  a club which stopped reporting partway through that month now has its
+    #   last entry there as its month-final one.  Nothing later exists for such a club, so it's
+    #   the newest for that club among the candidates.
+    months = sorted(set('%s' % m for m in loadedfor.values()) | (set(['%s' % prevmonth]) if prevmonth else set()))
+    yearexpr = 'IF(MONTH(monthstart) >= 7, YEAR(monthstart), YEAR(monthstart) - 1)'
+    stmt = """select ?.clubnumber, ?.id, ?.asof, ?.monthstart, latest.tmyear from ? inner join (select clubnumber, YEAREXPR as tmyear, max(asof) as m from ? where entrytype in ('M', 'L') and (asof > %s or monthstart in (MONTHS)) group by clubnumber, tmyear) latest on ?.clubnumber = latest.clubnumber and ?.asof = latest.m"""
+    stmt = stmt.replace('?', name).replace('YEAREXPR', yearexpr).replace('MONTHS', ','.join(['%s'] * len(months)))
+    curs.execute(stmt, [since] + months)
+    byyear = {}
+    for (clubnumber, id, asof, monthstart, tmyear) in curs.fetchall():
+        byyear.setdefault(tmyear, []).append((clubnumber, id, asof, monthstart))
+    for y in byyear:
+        upsertrows(curs, name, byyear[y], y)
+
+    # A club which isn't in the newest data still points at its old latest entry, which is now just
+    #   a daily entry; find its last month-final entry for the year instead.
+    curs.execute('SELECT lastfor.clubnumber, lastfor.tmyear FROM lastfor INNER JOIN ' + name + ' ON ' + name + '.id = lastfor.' + col + ' WHERE ' + name + ".entrytype = 'D'")
+    for (clubnumber, tmyear) in curs.fetchall():
+        rows = lastentry(curs, name, clubnumber, tmyear)
+        if rows:
+            upsertrows(curs, name, rows, tmyear)
+        elif name == 'distperf':
+            curs.execute('DELETE FROM lastfor WHERE clubnumber = %s AND tmyear = %s', (clubnumber, tmyear))
+        else:
+            curs.execute('UPDATE lastfor SET ' + col + ' = 0 WHERE clubnumber = %s AND tmyear = %s', (clubnumber, tmyear))
+
+
 class myclub():
     def __init__(self, clubnumber):
         self.clubnumber = clubnumber
@@ -35,27 +123,67 @@ class myclub():
     def addclub(self, id, asof, monthstart):
         self.clubperfid = id
         
-def doyear(y, curs):
-    """ Update or insert information for year 'y' """
+def computeyear(y, curs):
+    """ Return the lastfor rows for year 'y' as they should be """
     clubinfo = {}
-    distperf = dotable(curs, 'distperf', y)
     for (clubnumber, id, asof, monthstart) in dotable(curs, 'distperf', y):
         clubinfo[clubnumber] = myclub(clubnumber)
         clubinfo[clubnumber].adddist(id, asof, monthstart)
+    # Like doyear, ignore clubs which aren't in distperf
     for (clubnumber, id, asof, monthstart) in dotable(curs, 'areaperf', y):
-        clubinfo[clubnumber].addarea(id, asof, monthstart)
+        if clubnumber in clubinfo:
+            clubinfo[clubnumber].addarea(id, asof, monthstart)
     for (clubnumber, id, asof, monthstart) in dotable(curs, 'clubperf', y):
-        clubinfo[clubnumber].addclub(id, asof, monthstart)
-        
-    
+        if clubnumber in clubinfo:
+            clubinfo[clubnumber].addclub(id, asof, monthstart)
+
+    return [(c.clubnumber, c.clubperfid, c.areaperfid, c.distperfid, c.asof, c.monthstart, y) for c in list(clubinfo.values())]
+
+
+def latestfor(name):
+    """ SQL for a derived table of the lastfor entry of each club in the named table;
+        it takes the first and last monthstart of the year as parameters """
+    stmt = """(select ?.clubnumber, ?.id, ?.asof, ?.monthstart from ? inner join (select clubnumber, max(asof) as m from ? where entrytype in ('M', 'L') and monthstart >= %s and monthstart <= %s group by clubnumber) latest on ?.clubnumber = latest.clubnumber and ?.asof = latest.m)"""
+    return stmt.replace('?', name)
+
+
+def doyear(y, curs):
+    """ Update or insert information for year 'y'.
+        The three tables are combined on the server in a single statement; computeyear
+        does the same thing in Python (and is what --verify checks against). """
     colnames = ['clubnumber', 'clubperf_id', 'areaperf_id', 'distperf_id', 'asof', 'monthstart', 'tmyear']
-    colholders = ','.join(colnames)    
-    valueholders = ','.join(len(colnames) * ['%s'])
+    colholders = ','.join(colnames)
     updateclause = ','.join([cn + '=VALUES(' + cn + ')' for cn in colnames])
-    stmt = "INSERT INTO lastfor (" + colholders + ") VALUES (" + valueholders + ") ON DUPLICATE KEY UPDATE " + updateclause
-    
-    allclubs = [(c.clubnumber, c.clubperfid, c.areaperfid, c.distperfid, c.asof, c.monthstart, y) for c in list(clubinfo.values())]
-    curs.executemany(stmt, allclubs)
+    # The join is wrapped in a derived table to keep its ON clauses apart from ON DUPLICATE KEY.
+    stmt = "INSERT INTO lastfor (" + colholders + ") SELECT * FROM (SELECT d.clubnumber, COALESCE(c.id, 0), COALESCE(a.id, 0), d.id, d.asof, d.monthstart, %s FROM " + \
+           latestfor('distperf') + " d LEFT JOIN " + \
+           latestfor('clubperf') + " c ON c.clubnumber = d.clubnumber LEFT JOIN " + \
+           latestfor('areaperf') + " a ON a.clubnumber = d.clubnumber) allthree ON DUPLICATE KEY UPDATE " + updateclause
+    yearrange = ('%d-07-01' % y, '%d-06-01' % (y + 1))
+    curs.execute(stmt, (y,) + yearrange * 3)
+
+
+def verify(curs):
+    """ Compare the lastfor table against a full rebuild; returns the number of years which differ """
+    curs.execute("SELECT MIN(monthstart), MAX(monthstart) FROM distperf")
+    (firstmonth, lastmonth) = curs.fetchone()
+    if firstmonth is None:
+        return 0
+    # Check the same years as doit builds
+    firsttmyear = firstmonth.year + (1 if firstmonth.month <= 6 else 0)
+    bad = 0
+    for y in range(firsttmyear, tmyearof(lastmonth) + 1):
+        expected = set(computeyear(y, curs))
+        curs.execute("SELECT clubnumber, clubperf_id, areaperf_id, distperf_id, asof, monthstart, tmyear FROM lastfor WHERE tmyear = %s", (y,))
+        actual = set(curs.fetchall())
+        if expected != actual:
+            bad += 1
+            print('%d: %d entries differ from a full rebuild' % (y, len(expected ^ actual)))
+            for row in sorted(expected - actual):
+                print('   expected:', row)
+            for row in sorted(actual - expected):
+                print('   found:   ', row)
+    return bad
 
     
 def doit(curs, parms):
@@ -63,6 +191,8 @@ def doit(curs, parms):
     # We assume the same years in all three performance tables.
     curs.execute("SELECT MIN(monthstart), MAX(monthstart) FROM distperf")
     (firstmonth, lastmonth) = curs.fetchone()
+    if firstmonth is None:
+        return      # No performance data, so nothing to build
 
     firsttmyear = firstmonth.year + (1 if firstmonth.month <= 6 else 0)
     lasttmyear = lastmonth.year - (1 if lastmonth.month <= 6 else 0)
@@ -95,12 +225,15 @@ if __name__ == "__main__":
     parms = tmparms.tmparms()
     parms.add_argument('--quiet', '-q', action='count')
     parms.add_argument('--latestonly', action='store_true')
+    parms.add_argument('--verify', action='store_true', help='Compare the lastfor table (kept up-to-date by loaddb) against a full rebuild instead of rebuilding it')
     
     # Do global setup
     myglobals.setup(parms)
     curs = myglobals.curs
     conn = myglobals.conn
     
+    if parms.verify:
+        sys.exit(1 if verify(curs) else 0)
     
     doit(curs, parms)
     conn.commit()
@@ -1,98 +1,129 @@
 #!/usr/bin/env python3
 """ Require certain conditions
 
-    Sets the return code to 0 if all required conditions are true, else sets to 1
+    Sets the return code to 0 if all required conditions are true, else to a non-zero value
+    identifying the first one which is false.
 
+    With --condition, evaluates any number of named sets of conditions and writes a JSON map
+    of names to true/false instead.
+
+    Data conditions are answered from the data availability calendar which loaddb.py writes
+    (see datacalendar.py), so the database isn't used unless there is no calendar yet (or
+    --checkcalendar is given).
 """
 
-import tmutil, sys, datetime
+import tmutil, sys, datetime, argparse, json
 import tmglobals
+import datacalendar
 myglobals = tmglobals.tmglobals()
 
 def cleandate(s):
     return datetime.datetime.strptime(tmutil.cleandate(s, usetmyear=False), '%Y-%m-%d').date()
 
-def datacheck(s):
+def datacheck(s, cal):
+    """ True if the data calendar has the data described by 's' (Sn, Mn, or a date) """
     s = s.lower()
     if s.startswith('s') or s.startswith('m'):
         month = int(s[1:])
         # Compute the month to check:
-        year = myglobals.tmyear if month >= 7 else myglobals.tmyear + 1
-        start = "monthstart = '%d-%0.2d-01'" % (year, month)
+        year = cal.tmyear if month >= 7 else cal.tmyear + 1
+        start = '%d-%0.2d-01' % (year, month)
             
         # Do we need final for the month?
-        final = " AND ENTRYTYPE = 'M'" if s.startswith('m') else ''
-        
-        # See if we've got it
-        myglobals.curs.execute('SELECT COUNT(*) FROM clubperf WHERE ' + start + final)
+        if s.startswith('m'):
+            return cal.final(start)
+        return cal.started(start)
     else:
         # We have a specific date
-        myglobals.curs.execute('SELECT COUNT(*) FROM clubperf WHERE ASOF = %s', (cleandate(s),))
-    res = curs.fetchone()[0]
-    if res > 0:
-        return True
-    else:
-        return False
+        return cal.hasdate(cleandate(s))
         
-        
-
-### Insert classes and functions here.  The main program begins in the "if" statement below.
 
-if __name__ == "__main__":
- 
-    import tmparms
-    
-    # Establish parameters
-    parms = tmparms.tmparms()
-    # Add other parameters here
-
-    group = parms.add_argument_group('calendar parms')
+def addconditions(parser):
+    """ Add the condition parameters to a tmparms or argparse parser """
+    group = parser.add_argument_group('calendar parms')
     group.add_argument('--starting', type=str, help='First date this is true')
     group.add_argument('--ending', type=str, help='Last date this is true')
     group.add_argument('--between', type=str, nargs=2, help='First and last dates')
-    group = parms.add_argument_group('database parms', 'Specify Mn if month "n" must be complete; specify Sn if month "n" must be started.')
+    group = parser.add_argument_group('database parms', 'Specify Mn if month "n" must be complete; specify Sn if month "n" must be started.')
     group.add_argument('--datafor', type=str, help='Date or Month for which data must be available.')
     group.add_argument('--nodatafor', type=str, help='Date or Month for which data must NOT be available.')
-    group = parms.add_argument_group('TM Year parms')
+    group = parser.add_argument_group('TM Year parms')
     group.add_argument('--newtmyear', action='store_true', help='Data is available for the TM Year beginning July 1 of this calendar year')
     group.add_argument('--oldtmyear', action='store_true', help='Data is NOT available for the TM Year beginning July 1 of this calendar year')
 
-    # Do global setup
-    myglobals.setup(parms)
-    curs = myglobals.curs
-    conn = myglobals.conn
-    today = myglobals.today
 
-    if parms.starting:
-        starting = cleandate(parms.starting)
+def check(cond, cal, today):
+    """ Return 0 if all of the conditions in 'cond' are true, otherwise the return code for the first false one """
+    if cond.starting:
+        starting = cleandate(cond.starting)
         if today < starting:
-            sys.exit(1)
+            return 1
 
-    if parms.ending:
-        ending = cleandate(parms.ending)
+    if cond.ending:
+        ending = cleandate(cond.ending)
         if today > ending:
-            sys.exit(2)
+            return 2
 
-    if parms.between:
-        starting = cleandate(parms.between[0])
-        ending = cleandate(parms.between[1])
+    if cond.between:
+        starting = cleandate(cond.between[0])
+        ending = cleandate(cond.between[1])
         if ending < starting:
             ending = ending.replace(ending.year+1)
         if today < starting or today > ending:
-            sys.exit(3)
+            return 3
     
-    if parms.datafor:
-        if not datacheck(parms.datafor):
-            sys.exit(4)
+    if cond.datafor:
+        if not datacheck(cond.datafor, cal):
+            return 4
             
-    if parms.nodatafor:
-        if datacheck(parms.nodatafor):
-            sys.exit(5)
+    if cond.nodatafor:
+        if datacheck(cond.nodatafor, cal):
+            return 5
         
-    if parms.newtmyear:
-        if myglobals.today.year != myglobals.tmyear:
-            sys.exit(6)
+    if cond.newtmyear:
+        if today.year != cal.tmyear:
+            return 6
             
-    if parms.oldtmyear:
-        if myglobals.today.year == myglobals.tmyear:
-            sys.exit(7)
+    if cond.oldtmyear:
+        if today.year == cal.tmyear:
+            return 7
+
+    return 0
+
+
+def evaluate(conditions, cal, today):
+    """ Evaluate named conditions:  'conditions' maps each name to a string of condition parameters
+        (like '--datafor S2 --nodatafor 3/16').  Returns a dictionary mapping each name to True or False. """
+    parser = argparse.ArgumentParser(add_help=False)
+    addconditions(parser)
+    return {name: check(parser.parse_args(conditions[name].split()), cal, today) == 0 for name in conditions}
+        
+
+### Insert classes and functions here.  The main program begins in the "if" statement below.
+
+if __name__ == "__main__":
+ 
+    import tmparms
+    
+    # Establish parameters
+    parms = tmparms.tmparms()
+    # Add other parameters here
+
+    addconditions(parms)
+    parms.add_argument('--condition', '-c', action='append', default=[], metavar='NAME=CONDITIONS',
+                       help='Evaluate a named set of conditions (like "madness=--datafor S2 --nodatafor 3/16"); may be repeated.  Writes a JSON map of names to true/false instead of setting the return code.')
+    parms.add_argument('--calendar', default=datacalendar.defaultfile, help='Data availability calendar written by loaddb.py')
+    parms.add_argument('--checkcalendar', action='store_true', help='Check the calendar against the database (and rebuild it if need be) before using it')
+
+    # Do global setup
+    myglobals.setup(parms)
+    today = myglobals.today
+    cal = datacalendar.getcalendar(parms.calendar, myglobals, parms.checkcalendar)
+
+    if parms.condition:
+        conditions = dict(c.split('=', 1) for c in parms.condition)
+        json.dump(evaluate(conditions, cal, today), sys.stdout)
+        sys.stdout.write('\n')
+        sys.exit(0)
+
+    sys.exit(check(parms, cal, today))
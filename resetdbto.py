@@ -3,7 +3,7 @@
 
 # This is a standard skeleton to use in creating a new program in the TMSTATS suite.
 
-import dbconn, tmutil, sys, os, populatelastfor
+import dbconn, tmutil, sys, os, populatelastfor, datacalendar
 import tmglobals
 myglobals = tmglobals.tmglobals()
 
@@ -18,6 +18,7 @@ if __name__ == "__main__":
     parms = tmparms.tmparms()
     parms.add_argument('--quiet', '-q', action='count')
     parms.add_argument('--clubsonly', action='store_true')
+    parms.add_argument('--calendar', default=datacalendar.defaultfile, help='Data availability calendar to rewrite')
     parms.add_argument('resetto', default='yesterday', help="Date to reset the database to.")
     # Add other parameters here
 
@@ -56,5 +57,6 @@ if __name__ == "__main__":
     
     # And declare victory
     conn.commit()
+    datacalendar.writecalendar(curs, parms.calendar)
     conn.close()
     
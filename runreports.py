@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+""" Run the daily reports in one Python process.
+
+    Each step is a program from the suite (or a shell command) with its arguments.
+    Python programs are run in-process (with runpy) by a pool of worker processes which are
+    forked after the common modules have been imported, so each step starts warm:  no new
+    interpreter, no re-import of the suite, and each worker keeps its database connection
+    from one step to the next.  Shell commands (the .sh scripts and the mysql pipeline) are
+    still run as subprocesses.
+
+    Steps run as soon as every step named in their "after" list has finished (whether or not
+    it succeeded), so independent reports run in parallel.  A step with a "when" condition
+    runs only if require.py would succeed with those arguments (all of the conditions are
+    checked at once, from the data calendar, before anything runs); a step which "needs" clubs or
+    performance data is skipped if the caller says that data wasn't received.
+
+    At the end, we print how long each step took.  The return code is 0 if every step that
+    ran succeeded, 1 otherwise.
+"""
+
+import os, sys, time, glob, shlex, shutil, subprocess, runpy, traceback, multiprocessing, queue
+import dbconn, tmglobals, tmparms, datacalendar, require
+import tmutil, simpleclub       # Not used here, but imported so the workers inherit them
+myglobals = tmglobals.tmglobals()
+
+
+def isreal():
+    return os.environ.get('I_AM_D101TM', '') == '1'
+
+
+class step:
+    def __init__(self, name, command, after=(), when=None, needs=(), copy=(), cwd=None, env=None):
+        self.name = name
+        self.command = command      # Program (relative to SCRIPTPATH) and arguments, or a shell command
+        self.after = after          # Names of steps which must finish first
+        self.when = when            # Arguments to require.py which must be satisfied
+        self.needs = needs          # 'clubs' and/or 'perf'
+        self.copy = copy            # Files (glob patterns in the work directory) to copy to the report directory on success
+        self.cwd = cwd              # Directory to run in (default: the work directory)
+        self.env = env if env else {}
+
+    def inprocess(self):
+        words = shlex.split(self.command)
+        return words[0].endswith('.py') and not any(c in self.command for c in '|<>;&')
+
+
+def dailysteps(parms):
+    """ The reports run by daily.sh, in the order they used to be run """
+    today = myglobals.today
+    awardyear = today.year if today.month >= 8 else today.year - 1
+    script = sys.path[0]
+
+    steps = [
+        step('allstats', 'allstats.py --outfile performance.html', needs=('clubs', 'perf'), copy=('performance.html',)),
+        step('awardtallies', 'awardtallies.py', needs=('perf',)),
+        # The 'convert' command doesn't like the locale Python passes to subprocesses, so override it.
+        step('makeeducationals', 'makeeducationals.py --since %d-07-01' % awardyear, needs=('perf',), env={'LC_ALL': 'C'},
+             copy=('recentawards.*',)),
+        step('awardstsv', 'echo "select awards.* from awards inner join (select max(tmyear) as y from awards) a on awards.tmyear = a.y;" | mysql d101tm_tmstats  --batch --raw --silent > awards.tsv',
+             needs=('perf',), copy=('awards.tsv',)),
+
+        # Stellar September starts with August data and continues through September 15
+        step('stellar', 'renewals.py --program stellar --pct 75 100 --earn 75 100', needs=('perf',),
+             when='--newtmyear --datafor S8 --nodatafor 9/16', copy=('stellar.*',)),
+        # March Madness starts with February data and continues through March 15
+        step('madness', 'renewals.py --program madness --pct 75 100 --earn 75 100', needs=('perf',),
+             when='--datafor S2 --nodatafor 3/16', copy=('madness.*',)),
+        # President's Club runs once we have February data and stops when we have May 1 data
+        step('presidentsclub', 'presidentsclub.py --finaldate 4/30', needs=('perf',),
+             when='--datafor S2 --nodatafor 5/1', copy=('presidentsclub.txt',)),
+        # Early Achievers starts when we have data for the new year and ends when we have November data
+        step('earlyachievers', 'earlyachievers.py', needs=('perf',),
+             when='--newtmyear --nodatafor S11', copy=('earlyachievers.*',)),
+        # Take a Leap, Spring Forward, and Five for 5 are not being run this year.
+        # Bring Back the Base starts when we have April data and ends when we have June 30 data.
+        step('bringbackyourbase', 'bringbackyourbase.py', needs=('perf',),
+             when='--datafor S4 --nodatafor 6/30 --oldtmyear', copy=('bringbackyourbase*',)),
+        # Rev Up Your Engines starts with the end of May and ends on June 30.
+        step('revup', 'revup.py', needs=('perf',),
+             when='--datafor M5 --nodatafor 6/30 --oldtmyear', copy=('revup*',)),
+        # Sensational Summer runs once we have May data and stops when we have data for the next year
+        step('summer', 'summer.py', needs=('perf',),
+             when='--datafor S5 --oldtmyear', copy=('summer.*',)),
+
+        # During alignment season, run the daily alignment report
+        step('realignment', './dorealignment.sh > /dev/null', cwd=script, when='--between 2/1 5/11'),
+
+        # Daily housekeeping.  The realignment run uses the same alignment and map programs (and
+        #   runs clubchanges.py), so these wait for it, as they did in daily.sh.
+        step('clubchanges', './runclubchanges.sh', cwd=script, needs=('clubs',), after=('realignment',)),
+        step('dailyalignment', './dodailyalignment.sh', cwd=script, needs=('clubs',), after=('realignment',)),
+        step('anniversarytable', 'makeanniversarytable.py', cwd=script, needs=('clubs',), copy=('anniversary.csv',)),
+        step('onlinereport', 'makeonlinereport.py', cwd=script, needs=('clubs',), copy=('onlineclubs.html',)),
+        step('anniversaryopenhouses', 'updateanniversaryopenhouses.py', cwd=script, copy=('amazing.txt',)),
+
+        # Ingest rosters if need be, then process award letters
+        step('roster', './getroster.sh', cwd=script),
+        step('awardmail', 'sendawardmail.py' if isreal() else 'sendawardmail.py --dryrun', cwd=script, after=('roster',)),
+    ]
+
+    # Export the database and clear the web cache once everything else is done
+    if isreal():
+        everything = tuple(s.name for s in steps)
+        steps.append(step('exportdb', './exportdb.sh', cwd=script, after=everything))
+        steps.append(step('clearcache', 'clearcache.py --all', after=everything + ('exportdb',)))
+    return steps
+
+
+def runpython(command, name=None):
+    """ Run a program from the suite in this process; return its exit status.
+        'name' labels the step's query summary, if query instrumentation is on. """
+    words = shlex.split(command)
+    program = os.path.join(sys.path[0], words[0])
+    savedargv = sys.argv
+    sys.argv = [program] + words[1:]
+    # Each program builds its own parameters; don't let it see the last program's.
+    if '_the_instance' in tmparms.tmparms.__dict__:
+        del tmparms.tmparms._the_instance
+    try:
+        runpy.run_path(program, run_name='__main__')
+        rc = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            rc = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            rc = 1
+    except Exception:
+        traceback.print_exc()
+        rc = 1
+    finally:
+        sys.argv = savedargv
+        db = dbconn.dbconn.__dict__.get('_the_instance')
+        # Pool workers never run atexit handlers, so write each step's query summary now.
+        if db and getattr(db, 'querystats', None):
+            db.querystats.report('%s (%s)' % (name or words[0], command))
+            db.querystats.reset()
+        # A separate process would have thrown away anything it didn't commit; so do we.
+        # This also ends the transaction so the next step sees current data.
+        if db and getattr(db, 'conn', None):
+            db.conn.rollback()
+    return rc
+
+
+def runstep(s, workdir, reportdir):
+    """ Run one step in a worker; return (name, result, elapsed) """
+    start = time.time()
+    savedcwd = os.getcwd()
+    savedenv = {k: os.environ.get(k) for k in s.env}
+    try:
+        os.chdir(s.cwd or workdir)
+        print('Running %s' % s.name)
+        sys.stdout.flush()
+        os.environ.update(s.env)
+        if s.inprocess():
+            rc = runpython(s.command, s.name)
+        else:
+            rc = subprocess.call(s.command, shell=True)
+        if rc == 0 and isreal() and reportdir:
+            for pattern in s.copy:
+                for filename in glob.glob(os.path.join(workdir, pattern)):
+                    shutil.copy(filename, reportdir)
+        return (s.name, 'ok' if rc == 0 else 'rc %s' % rc, time.time() - start)
+    finally:
+        for (k, v) in savedenv.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        os.chdir(savedcwd)
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def skipping(steps, have, cal, today):
+    """ Decide which steps shouldn't run because their data is missing or their conditions
+        aren't met; return {name: reason} """
+    skip = {}
+    for s in steps:
+        missing = [n for n in s.needs if n not in have]
+        if missing:
+            skip[s.name] = 'skipped (no %s data)' % ' or '.join(missing)
+    conditions = {s.name: s.when for s in steps if s.when and s.name not in skip}
+    for (name, ok) in require.evaluate(conditions, cal, today).items():
+        if not ok:
+            skip[name] = 'skipped (%s)' % conditions[name]
+    return skip
+
+
+def runsteps(steps, jobs, workdir, reportdir, skip):
+    """ Run the steps not in 'skip' on a pool of 'jobs' workers, respecting 'after';
+        return {name: (result, elapsed)} """
+    results = {name: (reason, 0.0) for (name, reason) in skip.items()}
+    pending = [s for s in steps if s.name not in skip]
+
+    finished = queue.Queue()
+    # Fork so the workers inherit the modules we've already imported
+    pool = multiprocessing.get_context('fork').Pool(jobs)
+    running = 0
+    while pending or running:
+        ready = [s for s in pending if all(a in results for a in s.after)]
+        for s in ready:
+            pending.remove(s)
+            pool.apply_async(runstep, (s, workdir, reportdir), callback=finished.put,
+                             error_callback=lambda e, name=s.name: finished.put((name, 'failed: %s' % e, 0.0)))
+            running += 1
+        if not running:
+            # Whatever is left is waiting for a step that doesn't exist
+            for s in pending:
+                results[s.name] = ('skipped (waiting for %s)' % ', '.join(a for a in s.after if a not in results), 0.0)
+            break
+        (name, result, elapsed) = finished.get()
+        results[name] = (result, elapsed)
+        running -= 1
+    pool.close()
+    pool.join()
+    return results
+
+
+if __name__ == "__main__":
+
+    # Establish parameters
+    parms = tmparms.tmparms(description=__doc__)
+    parms.add_argument('--jobs', '-j', type=int, default=4, help='Number of reports to run at once')
+    parms.add_argument('--noclubs', action='store_true', help='Club information was not received; skip reports which need it')
+    parms.add_argument('--noperf', action='store_true', help='Performance information was not received; skip reports which need it')
+    parms.add_argument('--calendar', default=datacalendar.defaultfile, help='Data availability calendar written by loaddb.py')
+    parms.add_argument('--checkcalendar', action='store_true', help='Check the calendar against the database (and rebuild it if need be) before using it')
+    parms.add_argument('only', nargs='*', help='Run only these steps (default: all)')
+
+    # Do global setup (but don't connect; each worker makes its own connection)
+    myglobals.setup(parms)
+    workdir = os.path.abspath(parms.workdir)
+    reportdir = getattr(parms, 'reportdir', '')
+
+    steps = dailysteps(parms)
+    if parms.only:
+        steps = [s for s in steps if s.name in parms.only]
+        for s in steps:
+            s.after = tuple(a for a in s.after if a in parms.only)
+    have = set()
+    if not parms.noclubs:
+        have.add('clubs')
+    if not parms.noperf:
+        have.add('perf')
+
+    start = time.time()
+    # Check all of the conditions at once, before forking; if we had to connect to
+    # build (or check) the calendar, disconnect so the workers don't share the connection.
+    skip = skipping(steps, have, datacalendar.getcalendar(parms.calendar, myglobals, parms.checkcalendar), myglobals.today)
+    db = dbconn.dbconn.__dict__.get('_the_instance')
+    if db and getattr(db, 'conn', None):
+        db.close()
+    results = runsteps(steps, max(parms.jobs, 1), workdir, reportdir, skip)
+
+    print('\n%-24s %-40s %8s' % ('Step', 'Result', 'Seconds'))
+    for s in steps:
+        (result, elapsed) = results[s.name]
+        print('%-24s %-40s %8.1f' % (s.name, result, elapsed))
+    print('%-24s %-40s %8.1f' % ('Total', '', time.time() - start))
+
+    sys.exit(1 if any(r.startswith('rc') or r.startswith('failed') for (r, e) in results.values()) else 0)
@@ -3,7 +3,8 @@
 """
 
 import datetime, re
-from copy import deepcopy
+from bisect import bisect_right
+from dbconn import streamingcursor
 from tmutil import getTMYearFromDB
 from urllib.parse import urlsplit
 
@@ -19,7 +20,12 @@ def normalize(s):
 class Club:
     """ Keep information about a club """
     
+    # The club's fields live in __dict__ (programs use it as the club's record);
+    #   the comparison key is kept out of it and only computed when it's needed.
+    __slots__ = ('__dict__', '_cmp')
+    
     namegroups = {}
+    deltaplans = {}     # See deltaplan
     
     urlfixups = {'clubemail':'mailto', 
                  'clubwebsite':'http',
@@ -44,7 +50,8 @@ class Club:
     @classmethod
     def setgoodnames(self, names):
         """ Replace the set of "good" names and "bad" names (used in comparisons).
-            Does NOT recompute the compare value for previously-defined clubs. """
+            A club's compare value is computed when first used (and again after setvalue),
+            so clubs not yet compared use the new names; clubs already compared keep the old ones. """
         self.badnames = []
         self.goodnames = []
         for n in self.fieldnames:
@@ -120,7 +127,8 @@ class Club:
     @classmethod
     def getClubsOn(self, curs, date=None, goodnames=[]):
         """ Get the clubs which were in existence on a specified date (or the last date in the database)
-            or the most recent occurrence of each club if date=None (which includes suspended clubs) """
+            or the most recent occurrence of each club if date=None (which includes suspended clubs).
+            To get clubs for several dates, use a clubindex instead. """
         if date:
             # Make sure it's not past the end of the data
             curs.execute("SELECT MAX(lastdate) from clubs")
@@ -130,29 +138,36 @@ class Club:
             #   was data
             curs.execute("SELECT MAX(loadedfor) FROM loaded where tablename = 'clubs' AND loadedfor <= %s", (date,))
             date = self.stringify(curs.fetchone()[0])
-            curs.execute("SELECT * FROM clubs WHERE firstdate <= %s AND lastdate >= %s", (date, date))
+            # The clubs table is big, so stream the rows instead of fetching them all at once
+            clubcurs = streamingcursor(curs.connection)
+            clubcurs.execute("SELECT * FROM clubs WHERE firstdate <= %s AND lastdate >= %s", (date, date))
         else:
             tmyearstart = '%d-07-01' % getTMYearFromDB(curs)
-            curs.execute("SELECT clubs.* FROM clubs INNER JOIN (SELECT clubnumber, MAX(lastdate) AS m FROM clubs GROUP BY clubnumber) lasts ON lasts.m = clubs.lastdate AND lasts.clubnumber = clubs.clubnumber WHERE lasts.m >= %s", (tmyearstart,))
+            clubcurs = streamingcursor(curs.connection)
+            clubcurs.execute("SELECT clubs.* FROM clubs INNER JOIN (SELECT clubnumber, MAX(lastdate) AS m FROM clubs GROUP BY clubnumber) lasts ON lasts.m = clubs.lastdate AND lasts.clubnumber = clubs.clubnumber WHERE lasts.m >= %s", (tmyearstart,))
         # Get the fieldnames before we get anything else:
-        fieldnames = [f[0] for f in curs.description]
+        fieldnames = [f[0] for f in clubcurs.description]
+        res = self.makeclubs(fieldnames, clubcurs, goodnames)
+        clubcurs.close()
+        return res
+        
+    @classmethod
+    def makeclubs(self, fieldnames, rows, goodnames=[]):
+        """ Make a dictionary of clubs (by club number) from rows of the clubs table """
         if 'fieldnames' not in self.__dict__:
             Club.setfieldnames(fieldnames)
         if goodnames:
             Club.setgoodnames(goodnames)
     
         res = {}
-    
-        # OK, now build the list of clubs at the beginning of the period
-        for eachclub in curs.fetchall():
+        for eachclub in rows:
             club = Club(eachclub, fieldnames)
             res[club.clubnumber] = club
-            
         return res
         
     
     def __init__(self, values, fieldnames=None, fillall=False):
-        self.cmp = []
+        self._cmp = None
         if not fieldnames:
             fieldnames = self.fieldnames
         if fillall:
@@ -165,16 +180,21 @@ class Club:
             if name == 'place':
                 value = '\n'.join(value.split(';;'))  ## Clean up the database encoding of newlines in the address
             self.__dict__[name] = value
-            if name in self.goodnames and name not in self.badnames:
-                self.cmp.append(normalize(value))
+            
+    @property
+    def cmp(self):
+        """ The normalized values of the fields we compare, computed on first use """
+        if self._cmp is None:
+            self._cmp = [normalize(self.__dict__[name]) for name in self.goodnames
+                         if name in self.__dict__ and name not in self.badnames]
+        return self._cmp
                 
     def setvalue(self, name, value, evenIfEmpty=False):
         """ Set a single value. """
         value = self.stringify(value)
         if value or evenIfEmpty or name not in self.__dict__:
             self.__dict__[name] = value
-            if name not in self.badnames:
-                self.cmp.append(normalize(value))
+            self._cmp = None
                 
     def addvalues(self, values, fieldnames):
         """ Add values to the club; don't change anything already there. """
@@ -194,33 +214,47 @@ class Club:
     def __ne__(self, other):
         return self.cmp != other.cmp
         
+    @classmethod
+    def deltaplan(cls):
+        """ What delta compares, in order:  (name, None, None) for a single value, or (name, names, fn)
+            for a group of names whose combined value comes from fn.  A group is reported under the
+            first of its names we compare; the rest of its names are skipped.
+            Computed once for each set of good names. """
+        key = (cls, tuple(cls.goodnames))
+        if key not in cls.deltaplans:
+            plan = []
+            done = set()
+            for name in sorted(cls.goodnames):
+                if name in cls.namegroups:
+                    (names, fn) = cls.namegroups[name]
+                    if name not in done and fn:
+                        plan.append((name, names, fn))
+                    done.update(names)
+                else:
+                    plan.append((name, None, None))
+            cls.deltaplans[key] = plan
+        return cls.deltaplans[key]
+        
     def delta(self, other):
         """ Return tuples of (name, self, other) for any values which have changed that we care about.
             Items in 'namegroups' are grouped together into one item by the function provided. """
             
         res = []
-        namelist = sorted(self.goodnames)
-        myng = deepcopy(self.namegroups)
-        
-        for name in namelist:
-            if name in myng:
-                # Handle a field which gets a combined value
-                fn = myng[name][1]
-                if fn:
-                    mine = fn(self)   # Get the combined result for me
-                    his = fn(other)   # And for the other instance
-                else:
-                    mine = None
-                    his = None
-                # Now, inactivate the rest of the items from the list of desired fields
-                for n in myng[name][0]:
-                    myng[n][1] = None
+        mine = self.__dict__
+        his = other.__dict__
+        for (name, names, fn) in self.deltaplan():
+            if names:
+                # Only build the combined values if some part of them differs
+                if tuple(mine.get(n) for n in names) != tuple(his.get(n) for n in names):
+                    (a, b) = (fn(self), fn(other))
+                    if a != b:
+                        res.append((name, a, b))
             else:
                 # Just a normal single value
-                mine = self.__dict__.get(name,'')
-                his = other.__dict__.get(name,'')
-            if mine != his:
-                res.append((name, mine, his))
+                a = mine.get(name, '')
+                b = his.get(name, '')
+                if a != b:
+                    res.append((name, a, b))
         return res
         
     def __repr__(self):
@@ -256,3 +290,54 @@ class Club:
     meetgroup = ('meetingtime', 'meetingday')
     for n in meetgroup:
         namegroups[n] = [meetgroup, makemeeting]
+
+
+
+class clubindex:
+    """ All of the rows of the clubs table (or those in effect between 'start' and 'end'), read once
+        and indexed by firstdate, to answer getClubsOn for any number of dates without going back to
+        the database.  The index doesn't see later changes to the clubs table. """
+    
+    def __init__(self, curs, start=None, end=None):
+        curs.execute("SELECT MAX(lastdate) from clubs")
+        self.lastdate = Club.stringify(curs.fetchone()[0])
+        curs.execute("SELECT loadedfor FROM loaded WHERE tablename = 'clubs' ORDER BY loadedfor")
+        self.loaded = [Club.stringify(row[0]) for row in curs.fetchall()]
+        
+        # Only the part of history we were asked about (ORDER BY id matches getClubsOn's results);
+        #   'start' backs up to a date with data, as getClubsOn would.
+        if start:
+            start = self.datafor(start)
+        clubcurs = streamingcursor(curs.connection)
+        clubcurs.execute("SELECT * FROM clubs WHERE lastdate >= %s AND firstdate <= %s ORDER BY id",
+                         (start or '0001-01-01', end or '9999-12-31'))
+        self.fieldnames = [f[0] for f in clubcurs.description]
+        self.rows = list(clubcurs)
+        clubcurs.close()
+        
+        first = self.fieldnames.index('firstdate')
+        last = self.fieldnames.index('lastdate')
+        # (Rows without dates never match, as in SQL)
+        self.lastdates = [Club.stringify(row[last]) or '' for row in self.rows]
+        firstdates = [Club.stringify(row[first]) or '9999-12-31' for row in self.rows]
+        # Row numbers in order of firstdate, so a date's candidates are a prefix of the list
+        self.byfirst = sorted(range(len(self.rows)), key=lambda i: firstdates[i])
+        self.firstdates = [firstdates[i] for i in self.byfirst]
+        
+    def datafor(self, date):
+        """ The date getClubsOn uses for 'date' (None means the last date in the clubs table):
+            the last date with data on or before it, or None if there isn't one """
+        if self.lastdate is None:
+            return None     # The clubs table is empty
+        date = min(date, self.lastdate) if date else self.lastdate
+        i = bisect_right(self.loaded, date)
+        return self.loaded[i-1] if i else None
+        
+    def getClubsOn(self, date, goodnames=[]):
+        """ Get the clubs which were in existence on a specified date (or the last date in the
+            clubs table if date=None), like Club.getClubsOn; {} if there are none """
+        date = self.datafor(date)
+        if date is None:
+            return Club.makeclubs(self.fieldnames, [], goodnames)
+        rownums = sorted(i for i in self.byfirst[:bisect_right(self.firstdates, date)] if self.lastdates[i] >= date)
+        return Club.makeclubs(self.fieldnames, (self.rows[i] for i in rownums), goodnames)
@@ -0,0 +1,34 @@
+""" Shared setup for the tests.
+
+    The programs live at the top of the repository, so it goes on the path.
+
+    Tests which need MySQL use the 'testdb' fixture, which is skipped unless TMSTATS_TESTDB
+    names a scratch database:  its tables are created from tmstats.sql if need be and EMPTIED
+    before each test.  The host, user, and password come from ~/.my.cnf (as for the mysql command).
+"""
+
+import os, sys
+import pytest
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repodir)
+
+
+@pytest.fixture
+def testdb():
+    dbname = os.environ.get('TMSTATS_TESTDB')
+    if not dbname:
+        pytest.skip('TMSTATS_TESTDB is not set')
+    MySQLdb = pytest.importorskip('MySQLdb')
+    conn = MySQLdb.connect(read_default_file=os.path.expanduser('~/.my.cnf'), db=dbname, use_unicode=True, charset='UTF8')
+    curs = conn.cursor()
+    with open(os.path.join(repodir, 'tmstats.sql'), 'r') as infile:
+        for stmt in infile.read().split(';'):
+            if any(line.strip() and not line.strip().startswith('#') for line in stmt.splitlines()):
+                curs.execute(stmt)
+    for table in ('clubs', 'loaded', 'lastfor', 'clubchanges', 'distperf', 'clubperf', 'areaperf'):
+        curs.execute('DELETE FROM %s' % table)
+    conn.commit()
+    yield conn
+    conn.rollback()
+    conn.close()
@@ -0,0 +1,74 @@
+""" Tests for simpleclub.clubindex, using a stand-in for the database cursor """
+
+import pytest
+pytest.importorskip('MySQLdb')      # simpleclub needs dbconn
+from simpleclub import clubindex
+
+fieldnames = ('id', 'clubnumber', 'clubname', 'firstdate', 'lastdate')
+
+
+class fakecursor:
+    """ Answers the queries clubindex makes from a list of clubs rows and the dates loaded """
+    def __init__(self, rows, loaded):
+        self.rows = rows
+        self.loaded = loaded
+        self.connection = self
+        self.description = [(f,) for f in fieldnames]
+        self.result = []
+
+    def cursor(self, cursorclass=None):
+        return self
+
+    def execute(self, stmt, params=()):
+        if 'MAX(lastdate)' in stmt:
+            self.result = [(max(r[4] for r in self.rows) if self.rows else None,)]
+        elif 'FROM loaded' in stmt:
+            self.result = [(d,) for d in sorted(self.loaded)]
+        else:
+            (start, end) = params
+            self.result = [r for r in self.rows if r[4] >= start and r[3] <= end]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        pass
+
+
+rows = [(1, 100, 'Early Birds', '2019-01-01', '2019-03-31'),
+        (2, 100, 'Early Birds', '2019-04-01', '2019-06-30'),
+        (3, 200, 'Late Risers', '2019-02-01', '2019-05-31'),
+        (4, 300, 'Night Owls', '2019-06-01', '2019-06-30')]
+loaded = ['2019-01-01', '2019-02-01', '2019-03-31', '2019-04-01', '2019-05-31', '2019-06-30']
+
+
+def test_dates():
+    clubs = clubindex(fakecursor(rows, loaded))
+    assert sorted(clubs.getClubsOn('2019-03-15')) == ['100', '200']
+    assert clubs.getClubsOn('2019-04-15')['100'].id == '2'
+    # After the end of the data, we get the last date's clubs
+    assert sorted(clubs.getClubsOn('2020-01-01')) == ['100', '300']
+    # Before the first date with data, there are no clubs
+    assert clubs.getClubsOn('2018-12-31') == {}
+
+
+def test_no_date():
+    clubs = clubindex(fakecursor(rows, loaded))
+    assert sorted(clubs.getClubsOn(None)) == sorted(clubs.getClubsOn('2019-06-30'))
+    # As clubchanges.py does when there's no data before --fromdate
+    clubs = clubindex(fakecursor(rows, loaded), None, '2019-06-30')
+    assert sorted(clubs.getClubsOn(None)) == ['100', '300']
+
+
+def test_empty_table():
+    clubs = clubindex(fakecursor([], []))
+    assert clubs.getClubsOn(None) == {}
+    assert clubs.getClubsOn('2019-03-15') == {}
+    clubs = clubindex(fakecursor([], []), '2019-01-01', '2019-06-30')
+    assert clubs.getClubsOn('2019-03-15') == {}
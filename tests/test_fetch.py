@@ -0,0 +1,90 @@
+""" Tests for getperformancefiles' conditional fetching, against a local stand-in for the Toastmasters server """
+
+import os, threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+pytest.importorskip('requests')
+pytest.importorskip('MySQLdb')      # getperformancefiles needs tmglobals, which needs dbconn
+import getperformancefiles
+
+report = '\r\n'.join(['District,Division,Area,Club Number,Club Name'] +
+                     ['99,A,%d,%d,Club %d' % (n % 3 + 1, 1000 + n, n) for n in range(12)] +
+                     ['', 'Month of Jun, as of 07/02/2015', '']).encode('utf-8')
+etag = '"report-1"'
+
+
+class reporthandler(BaseHTTPRequestHandler):
+    """ Serves the one report with an ETag, answering 304 when the client already has it """
+    requests = []
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == etag:
+            self.requests.append(304)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.requests.append(200)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Length', str(len(report)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(report)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), reporthandler)
+    reporthandler.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d/export.aspx' % httpd.server_port
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, server):
+    """ Run in an empty directory with an empty fetch cache, with every report URL going to the server """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(getperformancefiles, 'cache', getperformancefiles.fetchcache(str(tmp_path / 'cache.json')))
+    monkeypatch.setattr(getperformancefiles, 'makeurl', lambda *args, **kwargs: server)
+    return tmp_path
+
+
+def fetch():
+    """ Get the report and save it as getperformancefiles does; returns (data, reportdate, written) """
+    (data, reportdate, monthend) = getperformancefiles.getreport('clubperf', '99', '6/30/2015', '2014-2015')
+    return (data, reportdate, getperformancefiles.savereport(data, getperformancefiles.makefilename('clubperf', reportdate)))
+
+
+def test_200_then_304(workdir):
+    (data, reportdate, written) = fetch()
+    assert written
+    assert '%s' % reportdate == '2015-07-02'
+    filename = workdir / 'clubperf.2015-07-02.csv'
+    contents = filename.read_text()
+    assert contents == report.decode('utf-8').replace('\r', '').strip('\n')
+    stamp = os.stat(filename).st_mtime_ns
+
+    # The second request is conditional; the server says nothing changed, so we use our copy
+    #   and don't rewrite the file.
+    (data, reportdate, written) = fetch()
+    assert reporthandler.requests == [200, 304]
+    assert data and not written
+    assert filename.read_text() == contents
+    assert os.stat(filename).st_mtime_ns == stamp
+    assert sorted(os.listdir(workdir)) == ['clubperf.2015-07-02.csv']
+
+
+def test_cache_survives_restart(workdir, monkeypatch):
+    (data, reportdate, written) = fetch()
+    getperformancefiles.cache.save()
+    monkeypatch.setattr(getperformancefiles, 'cache', getperformancefiles.fetchcache(str(workdir / 'cache.json')))
+    (data, reportdate, written) = fetch()
+    assert reporthandler.requests == [200, 304]
+    assert not written
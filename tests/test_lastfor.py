@@ -0,0 +1,60 @@
+""" Check that loaddb's incremental upkeep of lastfor matches a full rebuild (computeyear) """
+
+import loaddb, populatelastfor
+
+perftables = ('distperf', 'clubperf', 'areaperf')
+
+
+def load(conn, rows):
+    """ Load [(clubnumber, asof, monthstart)] for one or more dates into all three performance
+        tables the way loaddb does, then bring the entrytypes and lastfor up-to-date """
+    curs = conn.cursor()
+    for name in perftables:
+        curs.execute("SELECT MAX(asof), MAX(monthstart) FROM %s" % name)
+        (since, prevmonth) = curs.fetchone()
+        curs.executemany("INSERT INTO " + name + " (clubnumber, asof, monthstart) VALUES (%s, %s, %s)", rows)
+        loadedfor = {asof: monthstart for (clubnumber, asof, monthstart) in rows}
+        loaddb.markentrytypes(conn, name, set(loadedfor.values()), since, prevmonth)
+        populatelastfor.updatetable(curs, name, loadedfor, since, prevmonth)
+        conn.commit()
+
+
+def lastfor(curs, tmyear):
+    curs.execute("SELECT clubnumber, clubperf_id, areaperf_id, distperf_id, asof, monthstart, tmyear FROM lastfor WHERE tmyear = %s", (tmyear,))
+    return set(curs.fetchall())
+
+
+def test_dropout_across_month_boundary(testdb):
+    # Club 2 stops reporting on March 15; its last March entry becomes month-final only
+    #   when April's data arrives.
+    curs = testdb.cursor()
+    dates = [('2019-02-28', '2019-02-01'),
+             ('2019-03-01', '2019-02-01'),
+             ('2019-03-14', '2019-03-01'),
+             ('2019-03-15', '2019-03-01'),
+             ('2019-03-31', '2019-03-01'),
+             ('2019-04-05', '2019-04-01'),
+             ('2019-04-06', '2019-04-01')]
+    for (asof, monthstart) in dates:
+        clubs = (1, 2) if asof <= '2019-03-15' else (1,)
+        load(testdb, [(c, asof, monthstart) for c in clubs])
+        assert lastfor(curs, 2018) == set(populatelastfor.computeyear(2018, curs)), 'after loading %s' % asof
+
+    curs.execute("SELECT asof FROM lastfor WHERE clubnumber = 2 AND tmyear = 2018")
+    assert '%s' % curs.fetchone()[0] == '2019-03-15'
+
+
+def test_several_dates_in_one_load(testdb):
+    curs = testdb.cursor()
+    load(testdb, [(c, '2019-03-%02d' % d, '2019-03-01') for d in (14, 15) for c in (1, 2)])
+    load(testdb, [(1, '2019-03-31', '2019-03-01'), (1, '2019-04-05', '2019-04-01')])
+    assert lastfor(curs, 2018) == set(populatelastfor.computeyear(2018, curs))
+
+
+def test_empty_distperf(testdb):
+    # As in a rebuild which found no performance files
+    curs = testdb.cursor()
+    populatelastfor.doit(curs, None)
+    assert populatelastfor.verify(curs) == 0
+    curs.execute("SELECT COUNT(*) FROM lastfor")
+    assert curs.fetchone()[0] == 0
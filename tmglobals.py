@@ -2,9 +2,9 @@
 """ Set up for TMSTATS programs:
 
     1)  Parse arguments (via tmparse)
-    2)  Open database (via dbconn)
+    2)  Open database (via dbconn) - lazily, on first use of conn, curs, or tmyear
     3)  Save parms and database as globals
-    4)  Establish current TM year
+    4)  Establish current TM year (also on first use)
     5)  Establish current date
     6)  Go to the data directory (via tmutil)
 
@@ -27,9 +27,9 @@ class tmglobals(Singleton):
 
     def setup(self, *args, **kwargs):
         self.parms = args[0]
-        self.conn = None
-        self.curs = None
-        self.tmyear = None
+        self._conn = None
+        self._curs = None
+        self._tmyear = None
         #if kwargs.get('gotodatadir', True):
         #    curdir = os.path.realpath(os.curdir)  # Get the canonical directory
         #    lastpart = curdir.split(os.sep)[-1]
@@ -39,14 +39,33 @@ class tmglobals(Singleton):
             imp.reload(sys).setdefaultencoding(defaultencoding)
         if kwargs.get('parse', True):
             self.parms.parse(sections=kwargs.get('sections', None))
-        if kwargs.get('connect', True):
-            self.conn = dbconn.dbconn(self.parms.dbhost, self.parms.dbuser, self.parms.dbpass, self.parms.dbname)
-            self.curs = self.conn.cursor()
-            self.curs.execute("SELECT MAX(tmyear) FROM lastfor")
-            self.tmyear = self.curs.fetchone()[0]
+        # Programs which never use the database say connect=False; for everyone else, we connect
+        #   the first time conn, curs, or tmyear is used, so programs which don't need it don't pay for it.
+        self.connect = kwargs.get('connect', True)
         self.today = date.today()
         return self
 
+    @property
+    def conn(self):
+        if self._conn is None and self.connect:
+            self._conn = dbconn.dbconn(self.parms.dbhost, self.parms.dbuser, self.parms.dbpass, self.parms.dbname,
+                                       querylog=getattr(self.parms, 'querylog', None),
+                                       explainms=getattr(self.parms, 'explainms', None))
+        return self._conn
+
+    @property
+    def curs(self):
+        if self._curs is None and self.conn:
+            self._curs = self.conn.cursor()
+        return self._curs
+
+    @property
+    def tmyear(self):
+        if self._tmyear is None and self.curs:
+            self.curs.execute("SELECT MAX(tmyear) FROM lastfor")
+            self._tmyear = self.curs.fetchone()[0]
+        return self._tmyear
+
 if __name__ == '__main__':
     import tmparms
     p = tmparms.tmparms()
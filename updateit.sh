@@ -43,7 +43,9 @@ fi
 let ret=0  # Assume all is well
 
 # Get performance files, including latest club file from Toastmasters.
+# RC=3 means Toastmasters hasn't published anything we don't already have.
 $SCRIPTPATH/getperformancefiles.py
+let fetchrc=$?
 
 # Note the file status
 if [ ! -e "clubs.$yday.csv" ]
@@ -58,16 +60,22 @@ then
 fi
 
 
-# Load them into the database
-$SCRIPTPATH/loaddb.py
-let ret=$ret+$?
-
-# Update the lastfor table, normally for the last year, but if force, do all.
-if [[ "$force" = "force" ]]
+# Even if nothing new was fetched, an earlier load may have failed; loaddb.py --checkloaded
+#   exits with 0 only if every file we have is already in the database.
+if [[ $fetchrc == 3 && -z "$force" ]] && $SCRIPTPATH/loaddb.py --checkloaded
 then
-    $SCRIPTPATH/populatelastfor.py
+    # Nothing new, and everything we have is loaded, so there's nothing to load
+    let ret=$ret+1
 else
-    ../populatelastfor.py --latestonly
+    # Load them into the database
+    $SCRIPTPATH/loaddb.py
+    let ret=$ret+$?
+
+    # loaddb.py keeps the lastfor table up-to-date; if forced, rebuild it completely.
+    if [[ "$force" = "force" ]]
+    then
+        $SCRIPTPATH/populatelastfor.py
+    fi
 fi
 
 # Move old files to history unless otherwise requested